@@ -1,5 +1,10 @@
-from typing import List
-from collections import deque
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from grid import grid as puzzle_grid
+from rotations import ORIENTATIONS, ROLL_TABLE, TOP_FACE, INVERSE_ROLL, FORWARD, BACKWARD, ROLL_LEFT, ROLL_RIGHT
+
+if TYPE_CHECKING:
+    from telemetry import Telemetry
 
 
 class InvalidMove(Exception):
@@ -36,133 +41,232 @@ class NoMovesToUndo(Exception):
     pass
 
 class Dice:
+    # Change in (row, col) for each roll, indexed like ROLL_TABLE's columns
+    ROLL_STEPS = ((1, 0), (-1, 0), (0, -1), (0, 1))
+    ROLL_NAMES = ("forwards", "backwards", "left", "right")
+    # Entries in the undo log are a roll (0-3), or FACE_SET + face number for
+    # a face that was set along the way
+    FACE_SET = 4
+    # Same order grid.search tries moves in
+    SEARCH_ORDER = (FORWARD, ROLL_RIGHT, BACKWARD, ROLL_LEFT)
+
     def __init__(self, grid):
-        # Order:        Front      Back        Right       Left      Up      Down
-        self.faces = list(range(6))
-        self.map = {
-            i: None for i in range(6)
-        }
-        self.moves = deque(maxlen=512)
+        # One of the 24 orientations (see rotations.py), which says which face
+        # is in each position
+        self.orientation = 0
+        # Value on each face, indexed by face number
+        self.values = [None] * 6
+        # Undo log, see FACE_SET. Never dropping anything, or undoing (and n)
+        # would go wrong on long searches
+        self.moves = []
+        self.rolls = 0
         self.row = 0
         self.col = 0
         self.grid = grid
 
     def reset(self):
-        self.__init__(grid=self.grid)
+        self.orientation = 0
+        self.values[:] = [None] * 6
+        self.moves.clear()
+        self.rolls = 0
+        self.row = 0
+        self.col = 0
 
-    def rearrange_faces(self, new_order: List[int]):
+    @property
+    def faces(self) -> List[int]:
         """
-        Rearranges the current list of faces according to the new order given by
-        a list of indices.
+        Face number in each position. Order: Front, Back, Right, Left, Up, Down
+        """
+        return list(ORIENTATIONS[self.orientation])
 
-        :param new_order: List of indices.
+    def roll(self, direction: int, undoing: bool=False):
         """
-        faces = [self.faces[i] for i in new_order]
-        self.faces = faces
+        Roll the dice one tile over.
 
-    def roll_forward(self, undoing: bool=False):
-        if self.row + 1 >= self.grid_height:
-            raise InvalidMove("Can't move forwards out of bounds")
-        
-        new_order = [5, 4, 2, 3, 0, 1]
-        self.rearrange_faces(new_order)
-        if not undoing:
-            self.moves.append("forward")
+        :param direction: One of FORWARD, BACKWARD, ROLL_LEFT or ROLL_RIGHT
+        :param undoing: Don't record this roll, since it's undoing an earlier one
+        """
+        d_row, d_col = self.ROLL_STEPS[direction]
+        row = self.row + d_row
+        col = self.col + d_col
+        if not (0 <= row < self.grid_height and 0 <= col < self.grid_width):
+            raise InvalidMove(f"Can't move {self.ROLL_NAMES[direction]} out of bounds")
+
+        self.orientation = ROLL_TABLE[self.orientation][direction]
+        if undoing:
+            self.rolls -= 1
+        else:
+            self.moves.append(direction)
+            self.rolls += 1
+
+        self.row = row
+        self.col = col
 
-        self.row += 1
+    def roll_forward(self, undoing: bool=False):
+        self.roll(FORWARD, undoing)
 
     def roll_backward(self, undoing: bool=False):
-        if self.row - 1 < 0:
-            raise InvalidMove("Can't move backwards out of bounds")
-
-        new_order = [4, 5, 2, 3, 1, 0]
-        self.rearrange_faces(new_order)
-        if not undoing:
-            self.moves.append("backward")
-
-        self.row -= 1
+        self.roll(BACKWARD, undoing)
 
     def roll_left(self, undoing: bool=False):
-        if self.col - 1 < 0:
-            raise InvalidMove("Can't move left out of bounds")
-
-        new_order = [0, 1, 5, 4, 2, 3]
-        self.rearrange_faces(new_order)
-        if not undoing:
-            self.moves.append("left")
-
-        self.col -= 1
+        self.roll(ROLL_LEFT, undoing)
 
     def roll_right(self, undoing: bool=False):
-        if self.col + 1 >= self.grid_width:
-            raise InvalidMove("Can't move left out of bounds")
-
-        new_order = [0, 1, 4, 5, 3, 2]
-        self.rearrange_faces(new_order)
-        if not undoing:
-            self.moves.append("right")
-
-        self.col += 1
+        self.roll(ROLL_RIGHT, undoing)
 
     def face_is_set(self, i: int) -> bool:
-        return self.map[i] != None
+        return self.values[i] is not None
 
     def get_face_value(self, i: int):
         if not self.face_is_set(i):
             raise FaceNotSet(f"Face#{i} has not been set!")
         
-        return self.map[i]
+        return self.values[i]
 
     def get_top_face(self):
-        face_num = self.faces[4]
+        face_num = TOP_FACE[self.orientation]
         return self.get_face_value(face_num)
 
-    def set_top_face(self, val):
-        face_num = self.faces[4]
-        self.set_face(face_num, val)
+    def set_top_face(self, val, record: bool=False):
+        face_num = TOP_FACE[self.orientation]
+        self.set_face(face_num, val, record)
 
-    def set_face(self, i: int, val):
+    def set_face(self, i: int, val, record: bool=False):
+        """
+        :param record: Put this in the undo log, so undoing the last move clears it again
+        """
         if self.face_is_set(i):
             raise FaceAlreadySet(f"Face#{i} is already set to {self.get_face_value(i)} (tried setting to {val})")
 
-        self.map[i] = val
+        self.values[i] = val
+        if record:
+            self.moves.append(self.FACE_SET + i)
 
     def clear_face(self, i: int):
-        if self.map[i] is None:
+        if self.values[i] is None:
             raise FaceAlreadyCleared(f"Face#{i} is already cleared!")
         
-        self.map[i] = None
+        self.values[i] = None
 
     def undo_move(self):
-        try:
+        """
+        Undo the last roll, and clear any faces that were recorded as set since.
+
+        If there's no roll to undo, any faces recorded as set are still cleared,
+        then NoMovesToUndo is raised.
+        """
+        while self.moves:
             last_move = self.moves.pop()
-        except IndexError:
-            raise NoMovesToUndo()
-
-        if last_move == "forward":
-            self.roll_backward(undoing=True)
-        elif last_move == "backward":
-            self.roll_forward(undoing=True)
-        elif last_move == "left":
-            self.roll_right(undoing=True)
-        elif last_move == "right":
-            self.roll_left(undoing=True)
-
-    def try_move(self, move):
-        if move == "forward":
-            move = self.roll_forward
-        elif move == "backward":
-            move = self.roll_backward
-        elif move == "left":
-            move = self.roll_left
-        elif move == "right":
-            move = self.roll_right
+            if last_move >= self.FACE_SET:
+                self.values[last_move - self.FACE_SET] = None
+            else:
+                self.roll(INVERSE_ROLL[last_move], undoing=True)
+                return
 
+        raise NoMovesToUndo()
+
+    def get_path(self) -> List[Tuple[int, int]]:
+        """
+        Return (row, col) of every tile visited so far, by replaying the undo log
+        back from where we are now.
+        """
+        row, col = self.row, self.col
+        path = [(row, col)]
+        for move in reversed(self.moves):
+            if move < self.FACE_SET:
+                d_row, d_col = self.ROLL_STEPS[move]
+                row -= d_row
+                col -= d_col
+                path.append((row, col))
+        return path[::-1]
+
+    def search(self, end: Optional[Tuple[int, int]] = None, max_moves: int = 64,
+               telemetry: Optional["Telemetry"] = None) -> Optional[List[Tuple[int, int]]]:
+        """
+        Depth-first search for a way to the end tile from wherever the dice is
+        now, rolling this dice back and forth in place.
+
+        Each node just rolls (and maybe sets the top face) on the way down and
+        undoes it on the way back, so nothing gets copied. If a way is found,
+        the dice is left at the end tile, otherwise it's put back how it was.
+
+        :param end: (row, col) to get to, default the opposite corner to (0, 0)
+        :param max_moves: Give up on any path longer than this
+        :param telemetry: Optional counters, see telemetry.py
+        :return: get_path() at the end tile, or None if there's no way
+        """
+        if end is None:
+            end = (self.grid_height - 1, self.grid_width - 1)
+        end_row, end_col = end
+        grid = self.grid
+        height = self.grid_height
+        width = self.grid_width
+        values = self.values
+        moves = self.moves
+        start_rolls = self.rolls
+
+        # How far through SEARCH_ORDER we are at each depth
+        tries = [0]
+        if telemetry is not None:
+            telemetry.node(depth=self.rolls)
+        while tries:
+            if self.row == end_row and self.col == end_col:
+                return self.get_path()
+
+            i = tries[-1]
+            if i == 4 or self.rolls - start_rolls >= max_moves:
+                # Tried everything from here, so go back up
+                if i != 4 and telemetry is not None:
+                    telemetry.prune("max moves")
+                tries.pop()
+                if tries:
+                    self.undo_move()
+                continue
+            tries[-1] = i + 1
+
+            direction = self.SEARCH_ORDER[i]
+            d_row, d_col = self.ROLL_STEPS[direction]
+            row = self.row + d_row
+            col = self.col + d_col
+            if not (0 <= row < height and 0 <= col < width):
+                if telemetry is not None:
+                    telemetry.prune("off grid")
+                continue
+
+            face, remainder = divmod(grid[row][col] - grid[self.row][self.col], self.rolls + 1)
+            if remainder:
+                if telemetry is not None:
+                    telemetry.prune("no whole face")
+                continue
+
+            orientation = ROLL_TABLE[self.orientation][direction]
+            top = TOP_FACE[orientation]
+            top_value = values[top]
+            if top_value is not None and top_value != face:
+                if telemetry is not None:
+                    telemetry.prune("wrong face")
+                continue
+
+            self.orientation = orientation
+            moves.append(direction)
+            self.rolls += 1
+            self.row = row
+            self.col = col
+            if top_value is None:
+                values[top] = face
+                moves.append(self.FACE_SET + top)
+            tries.append(0)
+            if telemetry is not None:
+                telemetry.node(depth=self.rolls)
+
+        return None
+
+    def try_move(self, direction: int):
         # Get current tile's value
         a = self.grid[self.row][self.col]
 
         # Try moving to next tile, allow exception to occur if appropriate
-        move()
+        self.roll(direction)
         # If move was fine, get new tile's value
         b = self.grid[self.row][self.col]
         # Then check what face we would need on top afterwards to make this work
@@ -179,7 +283,7 @@ class Dice:
 
     @property
     def n(self) -> int:
-        return len(self.moves) + 1
+        return self.rolls + 1
 
     @property
     def grid_height(self) -> int:
@@ -199,11 +303,11 @@ class Dice:
         :param n: This turn's number
         :return: required dice face for this move
         """
-        face = (b - a) / n
-        if face % 1 != 0:
+        face, remainder = divmod(b - a, n)
+        if remainder:
             raise InvalidMove(f"Move from {a} to {b} on turn#{n} is impossible. No dice face could allow this.")
 
-        return int(face)
+        return face
 
 
 
@@ -211,14 +315,7 @@ class Dice:
 # Note grid is "upside-down" to make sure we start from position (0, 0)
 # That means "forwards" actually moves down in this grid, and vice versa for "backwards"
 # Left and right remain the same though
-grid = [
-    [0, 77, 32, 403, 337, 452],
-    [5, 23, -4, 592, 445, 620],
-    [-7, 2, 357, 452, 317, 395],
-    [186, 42, 195, 704, 452, 228],
-    [81, 123, 240, 443, 353, 508],
-    [57, 33, 132, 268, 492, 732]
-]
+grid = puzzle_grid[::-1].tolist()
 width = len(grid[0])
 height = len(grid)
 print(f"Grid is {height} rows x {width} cols")
@@ -0,0 +1,185 @@
+"""
+Breadth-first search for Die Agony that works on a whole layer of states at
+once with NumPy, instead of one state per Python call.
+
+Every state in a layer has made the same number of moves, so the move number
+is the same for the whole layer. The rest of each state is held in arrays:
+row, col, orientation (see rotations.py) and the six face values, with UNSET
+for faces that haven't been needed yet. Each layer is expanded in all four
+directions at once with table lookups, and duplicates are dropped by sorting.
+"""
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+from rotations import ROLL_TABLE, TOP_FACE
+from solver import DEFAULT_MAX_MOVES, MOVES, Solution, SolveResult
+
+if TYPE_CHECKING:
+    from telemetry import Telemetry
+
+# Stands in for None in the face values
+UNSET = np.iinfo(np.int64).min
+
+ROLL_ARRAY = np.array(ROLL_TABLE, dtype=np.int8)
+TOP_FACE_ARRAY = np.array(TOP_FACE, dtype=np.int8)
+
+
+class Layer:
+    """All the states after the same number of moves, plus where they came from."""
+    def __init__(self, rows: np.ndarray, cols: np.ndarray, orientations: np.ndarray, values: np.ndarray, parents: np.ndarray):
+        self.rows = rows
+        self.cols = cols
+        self.orientations = orientations
+        # Shape (states, 6), indexed by face number
+        self.values = values
+        # Index of each state's parent in the layer before
+        self.parents = parents
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def select(self, mask: np.ndarray) -> "Layer":
+        return Layer(self.rows[mask], self.cols[mask], self.orientations[mask], self.values[mask], self.parents[mask])
+
+
+def expand(grid: np.ndarray, layer: Layer, n: int) -> Layer:
+    """
+    Return every state one move on from this layer, on the n-th move, without duplicates.
+
+    :param grid: Tile values as an array of ints
+    :param layer: States to move from
+    :param n: This move's number
+    """
+    height, width = grid.shape
+    here = grid[layer.rows, layer.cols].astype(np.int64)
+    states = np.arange(len(layer))
+    parts = []
+    for roll, d_row, d_col in MOVES:
+        rows = layer.rows + d_row
+        cols = layer.cols + d_col
+        ok = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        # Off-grid ones get masked out, they just need somewhere to look
+        diff = grid[np.clip(rows, 0, height - 1), np.clip(cols, 0, width - 1)].astype(np.int64) - here
+        faces, remainders = np.divmod(diff, n)
+        ok &= remainders == 0
+
+        orientations = ROLL_ARRAY[layer.orientations, roll]
+        tops = TOP_FACE_ARRAY[orientations]
+        current = layer.values[states, tops]
+        ok &= (current == UNSET) | (current == faces)
+        if not ok.any():
+            continue
+
+        values = layer.values[ok]
+        # Setting it again when it already matches doesn't change anything
+        values[np.arange(len(values)), tops[ok]] = faces[ok]
+        parts.append(Layer(rows[ok], cols[ok], orientations[ok], values, states[ok]))
+
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return Layer(empty, empty, np.empty(0, dtype=np.int8), np.empty((0, 6), dtype=np.int64), empty)
+
+    layer = Layer(*(np.concatenate([getattr(part, name) for part in parts])
+                    for name in ("rows", "cols", "orientations", "values", "parents")))
+
+    _, first = np.unique(pack(layer, width), return_index=True)
+    # Keep them in the order they were found, like the other solvers
+    first.sort()
+    return layer.select(first)
+
+
+def pack(layer: Layer, width: int) -> np.ndarray:
+    """
+    Return one key per state, equal only for equal states.
+
+    Usually the face values only cover a small range, so the whole state fits
+    in one int64 (cell, then orientation, then each face in turn). Otherwise
+    each state's row of the arrays gets packed into a string of bytes instead,
+    which is much slower to sort.
+    """
+    values = layer.values
+    is_set = values != UNSET
+    # UNSET is below every real value, so it only comes out of max() if nothing's set
+    high = int(values.max()) if len(values) else UNSET
+    low = int(values.min(where=is_set, initial=high)) if high != UNSET else 0
+    high = max(high, low)
+    # Code 0 is unset, the rest are the values from low up
+    base = high - low + 2
+    cells = (int(layer.rows.max()) + 1) * width if len(layer) else 1
+    if cells * 24 * base ** 6 < 2 ** 63:
+        codes = np.where(is_set, values - low + 1, 0)
+        powers = base ** np.arange(5, -1, -1, dtype=np.int64)
+        return ((layer.rows * width + layer.cols) * 24 + layer.orientations) * base ** 6 + codes @ powers
+
+    keys = np.ascontiguousarray(np.column_stack((layer.rows, layer.cols, layer.orientations, values)))
+    return keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+
+
+def solve(grid, start: Optional[Tuple[int, int]] = None, end: Optional[Tuple[int, int]] = None,
+          max_moves: int = DEFAULT_MAX_MOVES, telemetry: Optional["Telemetry"] = None) -> SolveResult:
+    """
+    Find a shortest path to the end tile, a whole layer of states at a time.
+
+    Same states as solver.solve in "bfs" mode, just expanded with NumPy. Each
+    layer is kept (only its rows, cols and parents are needed afterwards) to
+    trace the path back.
+
+    :param grid: Tile values, e.g. grid.grid or from grid.load_grid
+    :param start: (row, col) to start from, default bottom-left
+    :param end: (row, col) to finish on, default top-right
+    :param max_moves: Longest path to consider
+    :param telemetry: Optional counters, see telemetry.py
+    :return: SolveResult with a shortest solution (if any) and number of states explored
+    """
+    # Left as it is, so a memory-mapped grid is only read in where the layers
+    # go (expand converts the values it looks up)
+    grid = np.asarray(grid)
+    height, width = grid.shape
+    if start is None:
+        start = (height - 1, 0)
+    if end is None:
+        end = (0, width - 1)
+
+    layer = Layer(np.array([start[0]]), np.array([start[1]]), np.zeros(1, dtype=np.int8),
+                  np.full((1, 6), UNSET, dtype=np.int64), np.array([-1]))
+    if start == end:
+        # Already there, without moving at all
+        if telemetry is not None:
+            telemetry.node(depth=0)
+        return SolveResult([trace(grid, [], layer, 0)], 0)
+
+    history: List[Layer] = []
+    explored = 0
+    for n in range(1, max_moves + 1):
+        if not len(layer):
+            break
+        if telemetry is not None:
+            telemetry.node(depth=n - 1, count=len(layer))
+        explored += len(layer)
+        history.append(layer)
+        layer = expand(grid, layer, n)
+
+        at_end = (layer.rows == end[0]) & (layer.cols == end[1])
+        if at_end.any():
+            if telemetry is not None:
+                telemetry.node(depth=n, count=int(at_end.sum()))
+            return SolveResult([trace(grid, history, layer, int(np.argmax(at_end)))], explored)
+
+    if telemetry is not None and len(layer):
+        telemetry.prune("max moves", len(layer))
+    return SolveResult([], explored)
+
+
+def trace(grid: np.ndarray, history: List[Layer], layer: Layer, i: int) -> Solution:
+    """Follow the parents back from state i of layer to the start."""
+    values = tuple(None if val == UNSET else int(val) for val in layer.values[i])
+    path = [(int(layer.rows[i]), int(layer.cols[i]))]
+    parent = layer.parents[i]
+    for previous in reversed(history):
+        path.append((int(previous.rows[parent]), int(previous.cols[parent])))
+        parent = previous.parents[parent]
+    path.reverse()
+
+    score = int(grid.sum(dtype=np.int64)) - sum(int(grid[row, col]) for row, col in set(path))
+    return Solution(path, values, score)
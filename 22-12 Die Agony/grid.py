@@ -1,14 +1,11 @@
 from __future__ import annotations
-from typing import List
+from typing import TYPE_CHECKING, List, NamedTuple, Optional, Tuple
 import numpy as np
- 
 
-FRONT = 0
-BACK = 1
-RIGHT = 2
-LEFT = 3
-UP = 4
-DOWN = 5 
+from rotations import ORIENTATIONS, ROLL_TABLE, TOP_FACE, FORWARD, BACKWARD, ROLL_LEFT, ROLL_RIGHT
+
+if TYPE_CHECKING:
+    from telemetry import Telemetry
 
 grid = np.array([
     [57, 33, 132, 268, 492, 732],
@@ -21,28 +18,32 @@ grid = np.array([
 height, width = grid.shape
 
 
+# A dice is (orientation, values): orientation is one of the 24 in rotations.py
+# and values is a tuple of the value on each face (by face number), or None if
+# it hasn't been set yet. Rolling only changes the orientation, so the values
+# are shared between dice until a face gets set.
+
 def get_top_face(dice):
-    return dice[UP]
+    orientation, values = dice
+    return values[TOP_FACE[orientation]]
 
 def set_top_face(dice, val):
-    dice[UP] = val
-
-def roll_dice(dice, dir: str):
-    if dir == "f":
-        order = [DOWN, UP, RIGHT, LEFT, FRONT, BACK]
-    elif dir == "b":
-        order = [UP, DOWN, RIGHT, LEFT, BACK, FRONT]
-    elif dir == "l":
-        order = [FRONT, BACK, DOWN, UP, RIGHT, LEFT]
-    elif dir == "r":
-        order = [FRONT, BACK, UP, DOWN, LEFT, RIGHT]
-    
-    return [dice[i] for i in order]
+    orientation, values = dice
+    face = TOP_FACE[orientation]
+    return orientation, values[:face] + (val,) + values[face + 1:]
+
+def roll_dice(dice, dir: int):
+    orientation, values = dice
+    return ROLL_TABLE[orientation][dir], values
+
+def get_top_face_after_move(dice, dir: int):
+    orientation, values = dice
+    return values[TOP_FACE[ROLL_TABLE[orientation][dir]]]
 
-def get_top_face_after_move(dice, dir: str):
-    dice_after_move = roll_dice(dice, dir)
-    top_face_after_move = get_top_face(dice_after_move)
-    return top_face_after_move
+def get_dice_faces(dice) -> list:
+    """Values in each position, in the order Front, Back, Right, Left, Up, Down."""
+    orientation, values = dice
+    return [values[face] for face in ORIENTATIONS[orientation]]
 
 def get_required_dice_face(a: int, b: int, n: int) -> int:
     """
@@ -51,31 +52,150 @@ def get_required_dice_face(a: int, b: int, n: int) -> int:
     :param a: Tile to move *from*
     :param b: Tile to move *to*
     :param n: This turn's number
-    :return: required dice face for this move
+    :return: required dice face for this move, or None if no whole number would do
     """
-    face = (b - a) / n
-    
-    # Everything was integers in the end, but I guess it didn't have to be so!
-    # if face % 1 != 0: 
-    #     return None
-        # raise InvalidMove(f"Move from {a} to {b} on turn#{n} is impossible. No dice face could allow this.")
+    face, remainder = divmod(b - a, n)
+    # Means no whole number on the dice could give us this
+    if remainder:
+        return None
 
     return face
 
 
 
-class Tile:
-    def __init__(self, val: int):
-        self.val = val
-        self.row = None
-        self.col = None
+def load_grid(path: str) -> np.ndarray:
+    """
+    Load a grid of tile values from a CSV file or a NumPy .npy file. Rows go
+    top to bottom, so by default we start bottom-left and end top-right.
+
+    .npy files are memory-mapped, and the solvers only read in the tiles (or
+    for solver.py, the rows) their search reaches.
+
+    :param path: Path to a .csv or .npy file
+    :return: 2D array of tile values
+    """
+    if path.endswith(".npy"):
+        return np.load(path, mmap_mode="r")
+    return np.loadtxt(path, delimiter=",", dtype=np.int64, ndmin=2)
+
+def generate_grid(height: int, width: int, start=None, end=None, max_face: int = 9, seed=None) -> np.ndarray:
+    """
+    Make a random grid that has at least one solution.
+
+    The solution is a random walk from start to end that only ever heads
+    towards the end (so it never revisits a tile), with each face of the dice
+    picked at random the first time it's needed. Every other tile gets a
+    random value from the same range as the ones on the walk.
+
+    :param height: Number of rows
+    :param width: Number of columns
+    :param start: (row, col) to start from, default bottom-left
+    :param end: (row, col) to finish on, default top-right
+    :param max_face: Faces are picked from -max_face to max_face
+    :param seed: Seed for the random numbers
+    :return: 2D array of tile values
+    """
+    rng = np.random.default_rng(seed)
+    row, col = (height - 1, 0) if start is None else start
+    end_row, end_col = (0, width - 1) if end is None else end
+
+    walk = {(row, col): 0}
+    orientation = 0
+    values = [None] * 6
+    score = 0
+    n = 1
+    while (row, col) != (end_row, end_col):
+        steps = []
+        if row != end_row:
+            steps.append((FORWARD, -1, 0) if end_row < row else (BACKWARD, 1, 0))
+        if col != end_col:
+            steps.append((ROLL_LEFT, 0, -1) if end_col < col else (ROLL_RIGHT, 0, 1))
+        roll, d_row, d_col = steps[rng.integers(len(steps))]
+
+        orientation = ROLL_TABLE[orientation][roll]
+        top = TOP_FACE[orientation]
+        if values[top] is None:
+            values[top] = int(rng.integers(-max_face, max_face + 1))
+        score += n * values[top]
+        n += 1
+        row += d_row
+        col += d_col
+        walk[(row, col)] = score
+
+    low = min(walk.values())
+    high = max(walk.values())
+    grid = rng.integers(low, high + 1, size=(height, width))
+    for (row, col), score in walk.items():
+        grid[row, col] = score
+    return grid
+
+
+
+# Change in (row, col) for each roll. Rows go top to bottom, so forward is up a row
+ROLL_STEPS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+
+
+class TileGraph:
+    """
+    A grid of tile values, with the moves between them read straight off the
+    array. Nothing is built up front, so big (or memory-mapped) grids only
+    cost anything where the search actually goes.
+    """
+    def __init__(self, grid: np.ndarray, end=None):
+        self.grid = grid
+        self.height, self.width = grid.shape
+        self.end = (0, self.width - 1) if end is None else tuple(end)
+
+    def tile(self, row: int, col: int) -> Optional[Tile]:
+        if not (0 <= row < self.height and 0 <= col < self.width):
+            return None
+        return Tile(row, col, self)
+
+    def diff(self, row: int, col: int, direction: int) -> Optional[int]:
+        """Change in value rolling off (row, col) in direction, or None if that's off the grid."""
+        d_row, d_col = ROLL_STEPS[direction]
+        if not (0 <= row + d_row < self.height and 0 <= col + d_col < self.width):
+            return None
+        return int(self.grid[row + d_row, col + d_col]) - int(self.grid[row, col])
+
+
+class Tile(NamedTuple):
+    """
+    A cell of a TileGraph. These are just its coordinates, so two for the
+    same cell are equal and every value comes from the graph's array.
+    """
+    row: int
+    col: int
+    graph: TileGraph
+
+    @property
+    def val(self) -> int:
+        return int(self.graph.grid[self.row, self.col])
+
+    @property
+    def diffs(self) -> Tuple[Optional[int], ...]:
+        """Change in value across each edge out of this tile, indexed by roll (None off the grid)."""
+        return tuple(self.graph.diff(self.row, self.col, direction) for direction in range(4))
+
+    @property
+    def forward(self) -> Optional[Tile]:
+        return self.graph.tile(self.row - 1, self.col)
 
-        self.forward = None
-        self.backward = None
-        self.right = None
-        self.left = None
+    @property
+    def backward(self) -> Optional[Tile]:
+        return self.graph.tile(self.row + 1, self.col)
 
-        self.end = False
+    @property
+    def right(self) -> Optional[Tile]:
+        return self.graph.tile(self.row, self.col + 1)
+
+    @property
+    def left(self) -> Optional[Tile]:
+        return self.graph.tile(self.row, self.col - 1)
+
+    @property
+    def end(self) -> bool:
+        return (self.row, self.col) == self.graph.end
 
     def can_move_to(self, other: Tile, path, dice):
         if other is None:
@@ -88,34 +208,44 @@ class Tile:
         #     print(f"{self.val} -> {other.val}; Already in path!")
         #     return False, None
 
-        n = len(path)
-        req_face = get_required_dice_face(self.val, other.val, n)
-        # Means no dice face could give us this (assuming integers only?)
-        if req_face is None:
-            return False, None
-
         # Figure out direction of this other tile
         if other == self.forward:
-            direction = "f"
+            direction = FORWARD
         elif other == self.backward:
-            direction = "b"
+            direction = BACKWARD
         elif other == self.left:
-            direction = "l"
+            direction = ROLL_LEFT
         elif other == self.right:
-            direction = "r"
+            direction = ROLL_RIGHT
         else:
             # Shouldn't get here, this means other is not even adjacent to this Tile!
             raise ValueError("Should only attempt moving to orthogonally adjacent tiles!")
 
+        new_dice = self.roll_to(direction, len(path), dice)
+        return new_dice is not None, new_dice
+
+    def roll_to(self, direction: int, n: int, dice):
+        """
+        Return the dice after rolling it off this tile on the n-th move, or None
+        if it can't go that way.
+        """
+        diff = self.graph.diff(self.row, self.col, direction)
+        if diff is None:
+            return None
+        req_face, remainder = divmod(diff, n)
+        # Means no whole number on the dice could give us this
+        if remainder:
+            return None
+
         new_dice = roll_dice(dice, direction)
         top_face_after_move = get_top_face(new_dice)
         if top_face_after_move is None:
-            set_top_face(new_dice, req_face)
-        if get_top_face(new_dice) == req_face:
-            return True, new_dice
+            return set_top_face(new_dice, req_face)
+        if top_face_after_move == req_face:
+            return new_dice
 
         # Otherwise dice had wrong face for this move
-        return False, None
+        return None
 
 
     def __str__(self) -> str:
@@ -138,61 +268,163 @@ class Tile:
     def __repr__(self) -> str:
         return f"Tile({self.val:3d})"
 
-# Initialise *graph* of Tiles from grid array
-tiles = np.vectorize(Tile)(grid)
-for row_num, row in enumerate(tiles):
-    for col_num, tile in enumerate(row):
-        # Just for easier printing once we've got result
-        tile.row = row_num
-        tile.col = col_num
-
-        # Ensure tiles only connect where appropriate
-        if row_num - 1 >= 0:
-            tile.forward = tiles[row_num - 1, col_num]
-        if row_num + 1 < height:
-            tile.backward = tiles[row_num + 1, col_num]
-        if col_num - 1 >= 0:
-            tile.left = tiles[row_num, col_num - 1]
-        if col_num + 1 < width:
-            tile.right = tiles[row_num, col_num + 1]
-
-# Mark exit tile as the end (i.e. the 732 in top-right corner)
-(tiles[0, width-1]).end = True
-
-def search(path: List[Tile], dice: List, answer):
+def shifted(step: int, size: int) -> slice:
+    """Slice of the indices i below size for which i - step is too."""
+    return slice(max(0, step), size + min(0, step))
+
+
+class FaceConstraints:
+    """
+    Extra checks for search(), to catch moves that are doomed before we make them.
+
+    On top of what can_move_to already checks:
+
+    - Forward checking: after a move, at least one move onwards has to be
+      possible too (unless we're at the end).
+    - Horizon: with a move limit, the end has to be close enough to still
+      reach in the moves left.
+    - Lookahead: with a move limit, there has to be some route to the end
+      whose every move divides by its move number, including the last move
+      into the end tile, which fixes the face on top then. Once all six
+      faces are set, each of those moves also has to need one of them.
+      See routes().
+    - Distinct faces (off by default, the puzzle doesn't ask for it and its
+      answer uses 9 twice): no two faces may have the same value.
+    - Dead states: a (tile, dice, move number) that's been searched without
+      finding the end is never searched again.
+    """
+    def __init__(self, distinct: bool = False, max_moves: Optional[int] = None, forward_check: bool = True, memo: bool = True,
+                 lookahead: bool = True):
+        self.distinct = distinct
+        self.max_moves = max_moves
+        self.forward_check = forward_check
+        self.memo = memo
+        self.lookahead = lookahead
+        self.dead = set()
+        # (graph, faces) -> routes()
+        self._routes = {}
+
+    def allowed(self, dice) -> bool:
+        if not self.distinct:
+            return True
+        values = [val for val in dice[1] if val is not None]
+        return len(values) == len(set(values))
+
+    def routes(self, graph: TileGraph, faces: Optional[frozenset] = None) -> np.ndarray:
+        """
+        Return live, where live[n, row, col] is whether the end could still be
+        reached by move max_moves from (row, col), with move n next.
+
+        This is worked back from the end a move number at a time, and only
+        asks that each move's change in value divides by its move number (and
+        comes out as one of faces, if given). Which way up the dice is gets
+        ignored, so it can only rule out too little, never too much.
+        """
+        key = (graph, faces)
+        live = self._routes.get(key)
+        if live is not None:
+            return live
+
+        values = np.asarray(graph.grid, dtype=np.int64)
+        live = np.zeros((self.max_moves + 2, graph.height, graph.width), dtype=bool)
+        live[:, graph.end[0], graph.end[1]] = True
+        for n in range(self.max_moves, 0, -1):
+            for d_row, d_col in ROLL_STEPS:
+                # Every tile with a neighbour that way, and those neighbours
+                here = shifted(-d_row, graph.height), shifted(-d_col, graph.width)
+                there = shifted(d_row, graph.height), shifted(d_col, graph.width)
+                diff = values[there] - values[here]
+                ok = (diff % n == 0) & live[n + 1][there]
+                if faces is not None:
+                    ok &= np.isin(diff // n, list(faces))
+                live[n][here] |= ok
+        self._routes[key] = live
+        return live
+
+    def check(self, tile: Tile, dice, n: int) -> Optional[str]:
+        """
+        Return why arriving at tile with this dice on move n can't work, or None
+        if it might.
+        """
+        if not self.allowed(dice):
+            return "distinct faces"
+        if self.max_moves is not None:
+            end_row, end_col = tile.graph.end
+            if n + abs(tile.row - end_row) + abs(tile.col - end_col) > self.max_moves:
+                return "horizon"
+            if self.lookahead and not tile.end:
+                values = dice[1]
+                faces = None if None in values else frozenset(values)
+                if not self.routes(tile.graph, faces)[n + 1, tile.row, tile.col]:
+                    return "lookahead"
+        if self.forward_check and not tile.end:
+            for direction in range(4):
+                next_dice = tile.roll_to(direction, n + 1, dice)
+                if next_dice is not None and self.allowed(next_dice):
+                    break
+            else:
+                return "forward check"
+        return None
+
+
+def search(path: List[Tile], dice: tuple, answer, telemetry: Optional[Telemetry] = None,
+           constraints: Optional[FaceConstraints] = None):
     tile = path[-1]
+    if telemetry is not None:
+        telemetry.node(depth=len(path) - 1)
     if tile.end:
         print("##################################################################")
         answer["path"] = path
-        answer["dice"] = dice
+        answer["dice"] = get_dice_faces(dice)
         return True
 
+    if constraints is not None and constraints.memo:
+        key = (tile.row, tile.col, dice, len(path))
+        if key in constraints.dead:
+            if telemetry is not None:
+                telemetry.prune("dead state")
+            return False
+
     # Cycle through all options from this tile and die, but in a depth-first way
     for other in (tile.forward, tile.right, tile.backward, tile.left):
         can, new_dice = tile.can_move_to(other, path, dice)
-        
+
+        if can and constraints is not None:
+            reason = constraints.check(other, new_dice, len(path))
+            if reason is not None:
+                if telemetry is not None:
+                    telemetry.prune(reason)
+                continue
+
         if can:
             new_path = path + [other]
-            success = search(new_path, new_dice, answer)
+            success = search(new_path, new_dice, answer, telemetry, constraints)
             if success:
                 return True
+        elif telemetry is not None:
+            telemetry.prune("off grid" if other is None else "wrong face")
 
+    if constraints is not None and constraints.memo:
+        constraints.dead.add(key)
     return False
 
 if __name__ == "__main__":
-    path = [tiles[5, 0]]
-    dice = [None for _ in range(6)]
+    from telemetry import Telemetry
+
+    graph = TileGraph(grid)
+    path = [graph.tile(height - 1, 0)]
+    dice = (0, (None,) * 6)
     answer = {"path": None, "dice": None}
-    search(path, dice, answer)
+    telemetry = Telemetry("die_agony")
+    search(path, dice, answer, telemetry, FaceConstraints())
+    telemetry.report("done", found=answer["path"] is not None)
     print(answer["path"])
     print(answer["dice"])
 
-    total = 0
-    num = 0
-    for tile in tiles.flatten():
-        if tile not in answer["path"]:
-            total += tile.val
-            num += 1
+    # Tiles can be visited more than once, so only count each of them once
+    visited = {(tile.row, tile.col): tile.val for tile in answer["path"]}
+    total = int(grid.sum()) - sum(visited.values())
+    num = grid.size - len(visited)
 
     print(f"Path was {len(answer['path']) - 1} moves long")
     print(f"Sum of {num} tiles *not* in path = {total}")
@@ -0,0 +1,58 @@
+"""
+Every way a die can be turned, numbered 0-23, and what each roll does to it.
+
+An orientation says which face (numbered 0-5) is in each position, in the
+order Front, Back, Right, Left, Up, Down. Orientation 0 is every face in its
+own position. Rolling only ever moves faces around, so there are just 24
+orientations and a roll is one lookup in ROLL_TABLE.
+"""
+from typing import List, Tuple
+
+# Positions
+FRONT = 0
+BACK = 1
+RIGHT = 2
+LEFT = 3
+UP = 4
+DOWN = 5
+
+# Rolls
+FORWARD = 0
+BACKWARD = 1
+ROLL_LEFT = 2
+ROLL_RIGHT = 3
+
+# Rolling undoes the roll in the opposite direction
+INVERSE_ROLL = (BACKWARD, FORWARD, ROLL_RIGHT, ROLL_LEFT)
+
+# Which position each position's face comes from after each roll
+ROLL_ORDERS = (
+    (DOWN, UP, RIGHT, LEFT, FRONT, BACK),
+    (UP, DOWN, RIGHT, LEFT, BACK, FRONT),
+    (FRONT, BACK, DOWN, UP, RIGHT, LEFT),
+    (FRONT, BACK, UP, DOWN, LEFT, RIGHT),
+)
+
+
+def build_rotations() -> Tuple[List[Tuple[int, ...]], List[Tuple[int, ...]]]:
+    """Find every orientation reachable from orientation 0 (in the order a BFS
+    finds them), and where each roll takes each one."""
+    orientations = [tuple(range(6))]
+    index = {orientations[0]: 0}
+    roll_table = []
+    for faces in orientations:
+        row = []
+        for order in ROLL_ORDERS:
+            rolled = tuple(faces[i] for i in order)
+            if rolled not in index:
+                index[rolled] = len(orientations)
+                orientations.append(rolled)
+            row.append(index[rolled])
+        roll_table.append(tuple(row))
+    return orientations, roll_table
+
+
+ORIENTATIONS, ROLL_TABLE = build_rotations()
+ORIENTATION_INDEX = {faces: i for i, faces in enumerate(ORIENTATIONS)}
+# Which face is on top in each orientation
+TOP_FACE = tuple(faces[UP] for faces in ORIENTATIONS)
@@ -0,0 +1,598 @@
+"""
+Solve Die Agony by searching over the whole state of the game, rather than
+just the path (like grid.search does).
+
+A state is (row, col, orientation, face values, move number), where the face
+values are indexed by face number (see rotations.py) and are None until that
+face is first needed. Two paths that reach the same state can only carry on in
+exactly the same ways, so each state is only expanded once. Going back over a
+tile is fine, it's just a different state as long as the move number or dice
+differs.
+"""
+from collections import deque
+import argparse
+from typing import TYPE_CHECKING, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from grid import load_grid, generate_grid
+from rotations import ORIENTATIONS, ROLL_TABLE, TOP_FACE, INVERSE_ROLL, FORWARD, BACKWARD, ROLL_LEFT, ROLL_RIGHT
+
+if TYPE_CHECKING:
+    from telemetry import Telemetry
+
+# (roll, change in row, change in col), in the same order grid.search tries
+# them. Row 0 is the top of the grid, so rolling forwards goes up a row
+MOVES = ((FORWARD, -1, 0), (ROLL_RIGHT, 0, 1), (BACKWARD, 1, 0), (ROLL_LEFT, 0, -1))
+
+# The state space is infinite without a limit, since the move number keeps going up
+DEFAULT_MAX_MOVES = 64
+
+# (row, col, orientation, face values, move number of the next move)
+State = Tuple[int, int, int, Tuple, int]
+
+
+class Solution(NamedTuple):
+    # (row, col) of every tile visited, from start to end
+    path: List[Tuple[int, int]]
+    # Value on each face (by face number) at the end, None if it was never needed
+    values: Tuple
+    # Sum of the tiles not on the path
+    score: int
+
+
+class SolveResult(NamedTuple):
+    solutions: List[Solution]
+    # Number of distinct states expanded
+    explored: int
+
+
+def next_states(grid: List[List[int]], state: State):
+    """
+    Yield every state we can get to from this one in a single move.
+
+    :param grid: Tile values, as nested lists of ints
+    :param state: State to move from
+    """
+    row, col, orientation, values, n = state
+    height = len(grid)
+    width = len(grid[0])
+    a = grid[row][col]
+    for roll, d_row, d_col in MOVES:
+        new_row = row + d_row
+        new_col = col + d_col
+        if not (0 <= new_row < height and 0 <= new_col < width):
+            continue
+
+        face, remainder = divmod(grid[new_row][new_col] - a, n)
+        if remainder:
+            # No whole number could be on top for this move
+            continue
+
+        new_orientation = ROLL_TABLE[orientation][roll]
+        top = TOP_FACE[new_orientation]
+        if values[top] is None:
+            new_values = values[:top] + (face,) + values[top + 1:]
+        elif values[top] == face:
+            new_values = values
+        else:
+            continue
+
+        yield new_row, new_col, new_orientation, new_values, n + 1
+
+
+class LazyRows:
+    """
+    The rows of a memory-mapped grid as lists of ints, each one only read in
+    the first time something looks at it.
+    """
+    def __init__(self, grid: np.memmap):
+        self.grid = grid
+        self.rows: List[Optional[List[int]]] = [None] * len(grid)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, row: int) -> List[int]:
+        values = self.rows[row]
+        if values is None:
+            values = self.rows[row] = self.grid[row].tolist()
+        return values
+
+
+def as_lists(grid) -> List[List[int]]:
+    # Plain lists of ints are much quicker to index than an array. A
+    # memory-mapped grid is only read in where the search goes
+    if isinstance(grid, np.memmap):
+        return LazyRows(grid)
+    return grid.tolist() if hasattr(grid, "tolist") else [list(row) for row in grid]
+
+
+def tile_sums(grid) -> Tuple[int, int]:
+    """
+    Return the sum of the positive tiles and the sum of the negative ones.
+
+    This goes a row at a time, so a memory-mapped grid is never read in all at once.
+    """
+    positive = 0
+    negative = 0
+    for values in grid:
+        values = np.asarray(values, dtype=np.int64)
+        positive += int(values[values > 0].sum())
+        negative += int(values[values < 0].sum())
+    return positive, negative
+
+
+def get_paths(parents: Dict[State, List[State]], state: State) -> List[List[State]]:
+    """Return every path of states from the start to this state."""
+    paths = []
+    stack = [(state, [state])]
+    while stack:
+        state, suffix = stack.pop()
+        if not parents[state]:
+            paths.append(suffix[::-1])
+        for parent in parents[state]:
+            stack.append((parent, suffix + [parent]))
+    return paths
+
+
+def solve(grid, start: Optional[Tuple[int, int]] = None, end: Optional[Tuple[int, int]] = None, mode: str = "bfs",
+          all_solutions: bool = False, max_moves: int = DEFAULT_MAX_MOVES, telemetry: Optional["Telemetry"] = None) -> SolveResult:
+    """
+    Search every state reachable from the start, for paths to the end tile.
+
+    Every predecessor of a state is recorded (not just the first one found), so
+    all the paths into a state can be recovered even though it's only expanded
+    once. Since the move number is part of the state, its predecessors all have
+    the same path length.
+
+    :param grid: Tile values, e.g. grid.grid or from grid.load_grid
+    :param start: (row, col) to start from, default bottom-left
+    :param end: (row, col) to finish on, default top-right
+    :param mode: "bfs" or "dfs"
+    :param all_solutions: Find every solution within max_moves, rather than just a shortest one
+    :param max_moves: Longest path to consider
+    :param telemetry: Optional counters, see telemetry.py
+    :return: SolveResult with the solutions (shortest first) and number of states explored
+    """
+    if mode not in ("bfs", "dfs"):
+        raise ValueError(f"Unknown search mode {mode!r}, expected 'bfs' or 'dfs'")
+
+    total = sum(tile_sums(grid))
+    grid = as_lists(grid)
+    height = len(grid)
+    width = len(grid[0])
+    if start is None:
+        start = (height - 1, 0)
+    if end is None:
+        end = (0, width - 1)
+
+    root = (start[0], start[1], 0, (None,) * 6, 1)
+    parents = {root: []}
+    ends = []
+    # Only a shortest path was asked for, so no need to look past the best one found
+    limit = max_moves
+    frontier = deque([root])
+    pop = frontier.popleft if mode == "bfs" else frontier.pop
+    explored = 0
+    while frontier:
+        state = pop()
+        row, col, _, _, n = state
+        if telemetry is not None:
+            telemetry.node(depth=n - 1)
+        if (row, col) == end:
+            ends.append(state)
+            if not all_solutions:
+                limit = min(limit, n - 1)
+            continue
+        if n > limit:
+            if telemetry is not None:
+                telemetry.prune("max moves")
+            continue
+
+        explored += 1
+        for child in next_states(grid, state):
+            if child in parents:
+                parents[child].append(state)
+                if telemetry is not None:
+                    telemetry.prune("visited")
+                continue
+            parents[child] = [state]
+            frontier.append(child)
+
+    if not all_solutions:
+        # DFS can find longer paths before the shortest
+        ends = [state for state in ends if state[4] - 1 == limit][:1]
+
+    solutions = []
+    for state in sorted(ends, key=lambda state: state[4]):
+        paths = get_paths(parents, state)
+        if not all_solutions:
+            paths = paths[:1]
+        for path in paths:
+            cells = [(row, col) for row, col, *_ in path]
+            score = total - sum(grid[row][col] for row, col in set(cells))
+            solutions.append(Solution(cells, state[3], score))
+
+    if telemetry is not None:
+        telemetry.count("states", len(parents))
+    return SolveResult(solutions, explored)
+
+
+def optimise(grid, start: Optional[Tuple[int, int]] = None, end: Optional[Tuple[int, int]] = None, objective: str = "max",
+             max_moves: int = DEFAULT_MAX_MOVES, telemetry: Optional["Telemetry"] = None) -> SolveResult:
+    """
+    Find the path to the end tile that leaves the biggest (or smallest) sum of
+    tiles off the path, with a depth-first branch and bound.
+
+    Which tiles have been visited now matters, so each state also carries a
+    bitmask of them (bit row * width + col, in a Python int so any size of grid
+    works), along with running sums of the positive and the negative values
+    still unvisited. The end tile is always visited, so it's left out of both.
+    The best a state could still do is leave every positive tile (or every
+    negative one) unvisited, so any state that can't beat the best path so far
+    is cut off.
+
+    :param grid: Tile values, e.g. grid.grid or from grid.load_grid
+    :param start: (row, col) to start from, default bottom-left
+    :param end: (row, col) to finish on, default top-right
+    :param objective: "max" or "min" sum of tiles not on the path
+    :param max_moves: Longest path to consider
+    :param telemetry: Optional counters, see telemetry.py
+    :return: SolveResult with the best solution (if any) and number of states explored
+    """
+    if objective not in ("min", "max"):
+        raise ValueError(f"Unknown objective {objective!r}, expected 'min' or 'max'")
+    sign = 1 if objective == "max" else -1
+
+    positive, negative = tile_sums(grid)
+    grid = as_lists(grid)
+    height = len(grid)
+    width = len(grid[0])
+    if start is None:
+        start = (height - 1, 0)
+    if end is None:
+        end = (0, width - 1)
+
+    for row, col in {start, end}:
+        if grid[row][col] > 0:
+            positive -= grid[row][col]
+        else:
+            negative -= grid[row][col]
+    end_bit = 1 << (end[0] * width + end[1])
+
+    # (row, col, orientation, face values, move number, visited, positive, negative)
+    root = (start[0], start[1], 0, (None,) * 6, 1, end_bit | 1 << (start[0] * width + start[1]), positive, negative)
+    parents = {root[:6]: None}
+    best = None
+    stack = [root]
+    explored = 0
+    while stack:
+        state = stack.pop()
+        row, col, _, _, n, visited, positive, negative = state
+        if telemetry is not None:
+            telemetry.node(depth=n - 1)
+        if (row, col) == end:
+            if best is None or sign * (positive + negative) > sign * (best[6] + best[7]):
+                best = state
+            continue
+        if best is not None and sign * (positive if sign == 1 else negative) <= sign * (best[6] + best[7]):
+            if telemetry is not None:
+                telemetry.prune("bound")
+            continue
+        if n > max_moves:
+            if telemetry is not None:
+                telemetry.prune("max moves")
+            continue
+
+        explored += 1
+        children = []
+        for child in next_states(grid, state[:5]):
+            bit = 1 << (child[0] * width + child[1])
+            if visited & bit:
+                child_visited, child_positive, child_negative = visited, positive, negative
+            else:
+                val = grid[child[0]][child[1]]
+                child_visited = visited | bit
+                child_positive = positive - val if val > 0 else positive
+                child_negative = negative if val > 0 else negative - val
+            key = child + (child_visited,)
+            if key in parents:
+                if telemetry is not None:
+                    telemetry.prune("visited")
+                continue
+            parents[key] = state[:6]
+            children.append(key + (child_positive, child_negative))
+        # So they come off the stack in the same order as MOVES
+        stack.extend(reversed(children))
+
+    solutions = []
+    if best is not None:
+        path = []
+        key = best[:6]
+        while key is not None:
+            path.append(key[:2])
+            key = parents[key]
+        solutions.append(Solution(path[::-1], best[3], best[6] + best[7]))
+
+    if telemetry is not None:
+        telemetry.count("states", len(parents))
+    return SolveResult(solutions, explored)
+
+
+def previous_states(grid: List[List[int]], state: Tuple[int, int, int, Tuple], n: int, end: Tuple[int, int]):
+    """
+    Yield every (row, col, orientation, face values) the dice could have been
+    in just before moving to this one on the n-th move.
+
+    The move number and the change in value fix the face that was on top once
+    it landed here, so this is next_states() run backwards. The end tile is
+    only ever the last tile, so it's never one of these.
+
+    :param grid: Tile values, as nested lists of ints
+    :param state: (row, col, orientation, face values) after the move
+    :param n: Number of the move that got here
+    :param end: (row, col) of the end tile
+    """
+    row, col, orientation, values = state
+    b = grid[row][col]
+    top = TOP_FACE[orientation]
+    for roll, d_row, d_col in MOVES:
+        prev_row = row - d_row
+        prev_col = col - d_col
+        if not (0 <= prev_row < len(grid) and 0 <= prev_col < len(grid[0])) or (prev_row, prev_col) == end:
+            continue
+
+        face, remainder = divmod(b - grid[prev_row][prev_col], n)
+        if remainder:
+            continue
+
+        if values[top] is None:
+            new_values = values[:top] + (face,) + values[top + 1:]
+        elif values[top] == face:
+            new_values = values
+        else:
+            continue
+
+        yield prev_row, prev_col, ROLL_TABLE[orientation][INVERSE_ROLL[roll]], new_values
+
+
+def join(values: Tuple, other: Tuple) -> Optional[Tuple]:
+    """Return both sets of face values together, or None if they disagree on a face."""
+    joined = []
+    for val, other_val in zip(values, other):
+        if val is None:
+            joined.append(other_val)
+        elif other_val is None or val == other_val:
+            joined.append(val)
+        else:
+            return None
+    return tuple(joined)
+
+
+def positions(state: Tuple) -> Tuple:
+    """
+    Return the value on the face in each position (see rotations.py), for a
+    (row, col, orientation, face values) state.
+
+    Where the dice can go only depends on these, not on which face is which.
+    """
+    orientation, values = state[2:4]
+    return tuple(values[face] for face in ORIENTATIONS[orientation])
+
+
+def solve_bidirectional(grid, start: Optional[Tuple[int, int]] = None, end: Optional[Tuple[int, int]] = None,
+                        max_moves: int = DEFAULT_MAX_MOVES, telemetry: Optional["Telemetry"] = None) -> SolveResult:
+    """
+    Find a shortest path to the end tile by searching forwards from the start
+    and backwards from the end, and joining the two halves where they meet.
+
+    Going backwards needs the move numbers, so every possible length of path
+    gets tried in turn (only ones with the right parity to reach the end). For
+    each length, whichever side has the smaller layer is expanded next, until
+    the two meet. The forward layers are kept and reused for every length, so
+    they're free from then on. A forward and a backward state join up if
+    they're on the same cell after the right number of moves, and don't
+    disagree about the value in any position.
+
+    The backward search starts from one state on the end tile, rather than
+    one per orientation: only the values in each position matter, so which
+    face ends up where can be matched up afterwards.
+
+    A length is skipped without searching if no move into the end tile on
+    that move number needs a whole number, or once the forward layers have
+    got that far without reaching the end. If a forward layer is empty,
+    nothing longer can work either.
+
+    :param grid: Tile values, e.g. grid.grid or from grid.load_grid
+    :param start: (row, col) to start from, default bottom-left
+    :param end: (row, col) to finish on, default top-right
+    :param max_moves: Longest path to consider
+    :param telemetry: Optional counters, see telemetry.py
+    :return: SolveResult with a shortest solution (if any) and number of states explored
+    """
+    total = sum(tile_sums(grid))
+    grid = as_lists(grid)
+    height = len(grid)
+    width = len(grid[0])
+    if start is None:
+        start = (height - 1, 0)
+    if end is None:
+        end = (0, width - 1)
+
+    distance = abs(start[0] - end[0]) + abs(start[1] - end[1])
+    if distance == 0:
+        # Already on the end tile, so there's nothing to join
+        if telemetry is not None:
+            telemetry.node(depth=0)
+        return SolveResult([Solution([start], (None,) * 6, total - grid[start[0]][start[1]])], 0)
+
+    # Change in value for each move into the end tile
+    last_moves = [grid[end[0]][end[1]] - grid[end[0] - d_row][end[1] - d_col] for _, d_row, d_col in MOVES
+                  if 0 <= end[0] - d_row < height and 0 <= end[1] - d_col < width]
+
+    # forward[k] maps each (row, col, orientation, face values) after k moves
+    # to the state it came from, leaving out the end tile. Only the first way
+    # found is kept, since we just want a shortest path. arrival[k] is the
+    # first (state, state it came from) found on the end tile after k moves
+    forward = [{(start[0], start[1], 0, (None,) * 6): None}]
+    arrival = {}
+    explored = 0
+    for length in range(distance, max_moves + 1, 2):
+        if length < len(forward):
+            # The forward layers already went past here without reaching the end
+            continue
+        if all(diff % length for diff in last_moves):
+            if telemetry is not None:
+                telemetry.prune("last move")
+            continue
+
+        # backward[j] maps each state j moves before the end to the state it
+        # went on to
+        backward = [{(end[0], end[1], 0, (None,) * 6): None}]
+        k = 0
+        while k + len(backward) - 1 < length:
+            if not forward[k]:
+                # Nothing lasts this many moves, so no longer path can work
+                return SolveResult([], explored)
+            if k + 1 < len(forward):
+                k += 1
+            elif len(forward[k]) <= len(backward[-1]):
+                layer = {}
+                for state in forward[k]:
+                    explored += 1
+                    if telemetry is not None:
+                        telemetry.node(depth=k)
+                    for child in next_states(grid, state + (k + 1,)):
+                        child = child[:4]
+                        if child[:2] == end:
+                            arrival.setdefault(k + 1, (child, state))
+                        elif child not in layer:
+                            layer[child] = state
+                    if k + 1 == length and k + 1 in arrival:
+                        # Found a shortest path, and this layer won't be needed again
+                        break
+                forward.append(layer)
+                k += 1
+            else:
+                # Move number of the move into the states in backward[-1]
+                n = length - len(backward) + 1
+                layer = {}
+                # Same as in solve(), states on the end tile don't count
+                if len(backward) > 1:
+                    explored += len(backward[-1])
+                for state in backward[-1]:
+                    if telemetry is not None:
+                        telemetry.node(depth=n)
+                    for parent in previous_states(grid, state, n, end):
+                        # Has to be somewhere the start can reach in the moves before it
+                        if abs(parent[0] - start[0]) + abs(parent[1] - start[1]) > n - 1:
+                            if telemetry is not None:
+                                telemetry.prune("too far from start")
+                            continue
+                        if parent not in layer:
+                            layer[parent] = state
+                backward.append(layer)
+                if not layer:
+                    if telemetry is not None:
+                        telemetry.prune("backward dead end")
+                    break
+        else:
+            if len(backward) == 1:
+                # Forwards all the way
+                if length in arrival:
+                    state, before = arrival[length]
+                    path = [state[:2]]
+                    for layer in reversed(forward[:length]):
+                        path.append(before[:2])
+                        before = layer[before]
+                    path.reverse()
+                    score = total - sum(grid[row][col] for row, col in set(path))
+                    return SolveResult([Solution(path, state[3], score)], explored)
+                continue
+
+            # Every forward state after k moves, by where it is
+            buckets = {}
+            for state in forward[k]:
+                buckets.setdefault(state[:2], []).append(state)
+
+            for state in backward[-1]:
+                for other in buckets.get(state[:2], ()):
+                    if telemetry is not None:
+                        telemetry.count("joins checked")
+                    joined = join(positions(other), positions(state))
+                    if joined is None:
+                        continue
+
+                    # Back to which face has which value, the way the forward half has them
+                    values = [None] * 6
+                    for position, face in enumerate(ORIENTATIONS[other[2]]):
+                        values[face] = joined[position]
+
+                    path = []
+                    before = other
+                    for layer in reversed(forward[:k + 1]):
+                        path.append(before[:2])
+                        before = layer[before]
+                    path.reverse()
+                    after = backward[-1][state]
+                    for layer in reversed(backward[:-1]):
+                        path.append(after[:2])
+                        after = layer[after]
+
+                    score = total - sum(grid[row][col] for row, col in set(path))
+                    return SolveResult([Solution(path, tuple(values), score)], explored)
+
+    return SolveResult([], explored)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve Die Agony on the puzzle grid, or any other.")
+    parser.add_argument("file", nargs="?", help="CSV or .npy grid to solve (default: the puzzle grid)")
+    parser.add_argument("--generate", nargs=2, type=int, metavar=("HEIGHT", "WIDTH"), help="solve a random grid of this size instead")
+    parser.add_argument("--seed", type=int, help="seed for --generate")
+    parser.add_argument("--start", nargs=2, type=int, metavar=("ROW", "COL"), help="default bottom-left")
+    parser.add_argument("--end", nargs=2, type=int, metavar=("ROW", "COL"), help="default top-right")
+    parser.add_argument("--mode", choices=("bfs", "dfs", "numpy", "bidirectional"), default="bfs",
+                        help="numpy: breadth-first a whole layer at a time (see frontier.py), bidirectional: meet in the middle")
+    parser.add_argument("--all", action="store_true", help="find every solution, not just a shortest one")
+    parser.add_argument("--optimise", choices=("min", "max"), help="find the path leaving the smallest/biggest sum of tiles off it")
+    parser.add_argument("--max-moves", type=int, default=DEFAULT_MAX_MOVES)
+    args = parser.parse_args()
+
+    start = tuple(args.start) if args.start else None
+    end = tuple(args.end) if args.end else None
+    if args.generate:
+        grid = generate_grid(*args.generate, start=start, end=end, seed=args.seed)
+    elif args.file:
+        grid = load_grid(args.file)
+    else:
+        from grid import grid
+
+    if args.all and args.mode in ("numpy", "bidirectional"):
+        parser.error(f"--mode {args.mode} only finds a shortest solution")
+
+    from telemetry import Telemetry
+
+    telemetry = Telemetry("die_agony_solver")
+    if args.optimise:
+        result = optimise(grid, start=start, end=end, objective=args.optimise, max_moves=args.max_moves, telemetry=telemetry)
+    elif args.mode == "numpy":
+        import frontier
+        result = frontier.solve(grid, start=start, end=end, max_moves=args.max_moves, telemetry=telemetry)
+    elif args.mode == "bidirectional":
+        result = solve_bidirectional(grid, start=start, end=end, max_moves=args.max_moves, telemetry=telemetry)
+    else:
+        result = solve(grid, start=start, end=end, mode=args.mode, all_solutions=args.all, max_moves=args.max_moves, telemetry=telemetry)
+    telemetry.report("done", solutions=len(result.solutions), explored=result.explored, shape=list(grid.shape))
+
+    print(f"Explored {result.explored} states, found {len(result.solutions)} solutions")
+    if result.solutions:
+        path, values, score = result.solutions[0]
+        print(f"{'Best' if args.optimise else 'Shortest'} was {len(path) - 1} moves long, with faces {values}")
+        print(f"Sum of tiles *not* in path = {score}")
+        print(" -> ".join(f"{grid[row, col]:>5}@({row}, {col})" for row, col in path))
+
+
+if __name__ == "__main__":
+    main()
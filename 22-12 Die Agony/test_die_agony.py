@@ -1,5 +1,18 @@
+import contextlib
+import io
+import os
+import random
+import tempfile
 import unittest
+
+import numpy as np
 from die_agony import grid, Dice, InvalidMove, FaceAlreadySet, FaceAlreadyCleared, FaceNotSet, NoMovesToUndo
+import grid as grid_module
+from grid import load_grid, generate_grid, get_required_dice_face, TileGraph, FaceConstraints
+from solver import MOVES, solve, optimise, solve_bidirectional, join, as_lists, LazyRows
+import frontier
+from telemetry import Telemetry
+from rotations import ORIENTATIONS, ROLL_TABLE, ROLL_ORDERS, INVERSE_ROLL, TOP_FACE, UP
 
 
 class TestDieAgony(unittest.TestCase):
@@ -141,8 +154,352 @@ class TestDieAgony(unittest.TestCase):
         for i, face in enumerate(faces):
             self.assertEqual(d.get_face_value(i), face)
 
+    def test_long_undo(self):
+        d = Dice(grid=grid)
+        # Far more moves than the old deque(maxlen=512) could hold
+        for _ in range(1000):
+            d.roll_forward()
+            d.roll_right()
+            d.roll_backward()
+            d.roll_left()
+        self.assertEqual(d.n, 4001)
+        for _ in range(4000):
+            d.undo_move()
+        self.assertEqual((d.row, d.col, d.n, d.faces), (0, 0, 1, [0, 1, 2, 3, 4, 5]))
+        with self.assertRaises(NoMovesToUndo):
+            d.undo_move()
+
+    def test_undo_face_set(self):
+        d = Dice(grid=grid)
+        d.set_face(0, "Kept")
+        # Left face (face#3) ends up on top
+        d.roll_right()
+        d.set_top_face("Cleared", record=True)
+        self.assertEqual(d.get_face_value(3), "Cleared")
+        self.assertEqual(d.n, 2)
+        # Undoing the roll also clears the face set after it, but not the one before
+        d.undo_move()
+        self.assertEqual(d.n, 1)
+        self.assertFalse(d.face_is_set(3))
+        self.assertEqual(d.get_face_value(0), "Kept")
+        with self.assertRaises(NoMovesToUndo):
+            d.undo_move()
+
+        # Faces recorded before any roll still get cleared, but there's no roll to undo
+        d = Dice(grid=grid)
+        d.set_top_face("Cleared", record=True)
+        with self.assertRaises(NoMovesToUndo):
+            d.undo_move()
+        self.assertFalse(d.face_is_set(4))
+        self.assertEqual(d.moves, [])
+
+    def test_search(self):
+        d = Dice(grid=grid)
+        path = d.search()
+        self.assertEqual(len(path) - 1, 32)
+        self.assertEqual((path[0], path[-1]), ((0, 0), (5, 5)))
+        self.assertEqual(d.n, 33)
+        self.assertEqual(sorted(d.values), [-9, -3, 5, 7, 9, 9])
+        # Same path as grid.search, just upside-down
+        unvisited = sum(grid[row][col] for row in range(6) for col in range(6) if (row, col) not in path)
+        self.assertEqual(unvisited, 1935)
+
+        # Too short to get there, so should put everything back how it was
+        d.reset()
+        values = d.values
+        self.assertIsNone(d.search(max_moves=20))
+        self.assertEqual((d.row, d.col, d.n, d.moves, d.orientation), (0, 0, 1, [], 0))
+        self.assertIs(d.values, values)
+        self.assertEqual(values, [None] * 6)
+
+    def test_rotations(self):
+        # A die can only be turned 24 ways, and they're all different
+        self.assertEqual(len(ORIENTATIONS), 24)
+        self.assertEqual(len(set(ORIENTATIONS)), 24)
+
+        for orientation, faces in enumerate(ORIENTATIONS):
+            self.assertEqual(TOP_FACE[orientation], faces[UP])
+            for direction, order in enumerate(ROLL_ORDERS):
+                with self.subTest(orientation=orientation, direction=direction):
+                    rolled = ROLL_TABLE[orientation][direction]
+                    # Table agrees with rearranging the faces by hand
+                    self.assertEqual(ORIENTATIONS[rolled], tuple(faces[i] for i in order))
+                    # Rolling back again undoes it
+                    self.assertEqual(ROLL_TABLE[rolled][INVERSE_ROLL[direction]], orientation)
+
+    def test_top_face_follows_rolls(self):
+        d = Dice(grid=grid)
+        d.set_top_face("Up")
+        d.roll_forward()
+        # Up face is now at the back, and front face (face#0) is on top
+        self.assertEqual(d.faces[1], 4)
+        with self.assertRaises(FaceNotSet):
+            d.get_top_face()
+        d.set_top_face("Front")
+        self.assertEqual(d.get_face_value(0), "Front")
+        d.undo_move()
+        self.assertEqual(d.get_top_face(), "Up")
+
+
+
+class TestSolver(unittest.TestCase):
+    def test_puzzle_grid(self):
+        from grid import grid as puzzle_grid
+        for mode in ("bfs", "dfs"):
+            with self.subTest(mode=mode):
+                result = solve(puzzle_grid, mode=mode)
+                self.assertEqual(len(result.solutions), 1)
+                path, values, score = result.solutions[0]
+                self.assertEqual(len(path) - 1, 32)
+                self.assertEqual((path[0], path[-1]), ((5, 0), (0, 5)))
+                unvisited = sum(puzzle_grid[row][col] for row in range(6) for col in range(6) if (row, col) not in path)
+                self.assertEqual(unvisited, 1935)
+                self.assertEqual(score, 1935)
+
+    def test_all_solutions(self):
+        # Any face 0 works anywhere, so every path is fine
+        flat = [[0, 0], [0, 0]]
+        for mode in ("bfs", "dfs"):
+            with self.subTest(mode=mode):
+                shortest = solve(flat, mode=mode, max_moves=4)
+                self.assertEqual(len(shortest.solutions), 1)
+                self.assertEqual(len(shortest.solutions[0].path), 3)
+
+                # Two ways round in 2 moves, four in 4 moves, and none in an odd number
+                everything = solve(flat, mode=mode, all_solutions=True, max_moves=4)
+                lengths = sorted(len(solution.path) - 1 for solution in everything.solutions)
+                self.assertEqual(lengths, [2, 2, 4, 4, 4, 4])
+                for solution in everything.solutions:
+                    # Never passes through the end on the way
+                    self.assertNotIn((0, 1), solution.path[:-1])
+
+    def test_generated_grids(self):
+        for seed in range(5):
+            with self.subTest(seed=seed):
+                board = generate_grid(12, 9, start=(11, 8), end=(0, 0), seed=seed)
+                result = solve(board, start=(11, 8), end=(0, 0), max_moves=40)
+                self.assertTrue(result.solutions)
+                path = result.solutions[0].path
+                self.assertEqual((path[0], path[-1]), ((11, 8), (0, 0)))
+
+    def test_load_grid(self):
+        board = generate_grid(7, 5, seed=0)
+        with tempfile.TemporaryDirectory() as folder:
+            csv_path = os.path.join(folder, "board.csv")
+            npy_path = os.path.join(folder, "board.npy")
+            np.savetxt(csv_path, board, delimiter=",", fmt="%d")
+            np.save(npy_path, board)
+            for path in (csv_path, npy_path):
+                with self.subTest(path=os.path.basename(path)):
+                    loaded = load_grid(path)
+                    np.testing.assert_array_equal(loaded, board)
+                    self.assertEqual(solve(loaded).solutions, solve(board).solutions)
+                    self.assertEqual(frontier.solve(loaded).solutions, solve(board).solutions)
+                    del loaded
+
+    def test_memory_mapped_rows(self):
+        board = generate_grid(7, 5, seed=0).astype(np.int32)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "board.npy")
+            np.save(path, board)
+            loaded = load_grid(path)
+            rows = as_lists(loaded)
+            self.assertIsInstance(rows, LazyRows)
+            self.assertEqual(rows[2][3], board[2, 3])
+            self.assertIsInstance(rows[2][3], int)
+            # Only the row that was looked at has been read in
+            self.assertEqual([row is not None for row in rows.rows], [False, False, True, False, False, False, False])
+            self.assertEqual(frontier.solve(loaded).solutions, solve(board).solutions)
+            self.assertEqual(optimise(loaded).solutions, optimise(board).solutions)
+            del loaded, rows
+
+    def test_required_face_is_exact(self):
+        self.assertEqual(get_required_dice_face(508, 732, 14), 16)
+        self.assertIsInstance(get_required_dice_face(508, 732, 14), int)
+        self.assertEqual(get_required_dice_face(5, -7, 2), -6)
+        # Floats would get these wrong (or let 2.5 be set on a face)
+        self.assertIsNone(get_required_dice_face(0, 5, 2))
+        self.assertIsNone(get_required_dice_face(0, 10**17 + 1, 10**17))
+        self.assertEqual(get_required_dice_face(0, 3 * (10**17 + 1), 10**17 + 1), 3)
+
+    def grid_search(self, board, constraints=None):
+        graph = TileGraph(np.asarray(board))
+        answer = {"path": None, "dice": None}
+        telemetry = Telemetry("test", stream=io.StringIO())
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = grid_module.search([graph.tile(len(board) - 1, 0)], (0, (None,) * 6), answer, telemetry, constraints)
+        return found, answer, telemetry
+
+    def test_face_constraints(self):
+        found, plain, plain_telemetry = self.grid_search(grid_module.grid)
+        self.assertTrue(found)
+        found, constrained, telemetry = self.grid_search(grid_module.grid, FaceConstraints(max_moves=40))
+        self.assertTrue(found)
+        self.assertEqual([(tile.row, tile.col) for tile in constrained["path"]], [(tile.row, tile.col) for tile in plain["path"]])
+        self.assertEqual(constrained["dice"], plain["dice"])
+        self.assertLess(telemetry.nodes, plain_telemetry.nodes)
+
+        # The answer uses 9 twice, so there's no way through with distinct faces
+        found, _, _ = self.grid_search(grid_module.grid, FaceConstraints(distinct=True))
+        self.assertFalse(found)
+
+        # Horizon can't go below the distance to the end
+        found, _, telemetry = self.grid_search(grid_module.grid, FaceConstraints(max_moves=9))
+        self.assertFalse(found)
+        self.assertEqual(telemetry.nodes, 1)
+
+    def test_dead_state_memo(self):
+        # No way through, so everything within the move limit gets searched
+        board = generate_grid(6, 6, seed=1, max_face=2)
+        board[0, 5] += 1
+        counts = {}
+        for memo in (False, True):
+            found, _, telemetry = self.grid_search(board, FaceConstraints(max_moves=24, memo=memo, lookahead=False))
+            self.assertFalse(found)
+            counts[memo] = telemetry.nodes
+        self.assertLess(counts[True], counts[False])
+
+    def test_lookahead(self):
+        # The end's been knocked out of reach, which lookahead sees from the start
+        board = generate_grid(6, 6, seed=1, max_face=2)
+        board[0, 5] += 1
+        found, _, telemetry = self.grid_search(board, FaceConstraints(max_moves=24))
+        self.assertFalse(found)
+        self.assertEqual(telemetry.nodes, 1)
+
+        found, plain, plain_telemetry = self.grid_search(grid_module.grid, FaceConstraints(max_moves=40, lookahead=False))
+        found, ahead, telemetry = self.grid_search(grid_module.grid, FaceConstraints(max_moves=40))
+        self.assertTrue(found)
+        self.assertEqual([(tile.row, tile.col) for tile in ahead["path"]], [(tile.row, tile.col) for tile in plain["path"]])
+        self.assertLess(telemetry.nodes, plain_telemetry.nodes)
+
+        # It only ever rules out states that couldn't get there anyway
+        rng = random.Random(0)
+        for seed in range(40):
+            height, width = rng.randint(2, 5), rng.randint(2, 5)
+            board = generate_grid(height, width, seed=seed, max_face=rng.choice((1, 2, 3)))
+            if seed % 2:
+                board[rng.randrange(height), rng.randrange(width)] += 1
+            max_moves = rng.randint(height + width - 2, 12)
+            with self.subTest(seed=seed):
+                results = [self.grid_search(board, FaceConstraints(max_moves=max_moves, forward_check=False, memo=False, lookahead=lookahead))
+                           for lookahead in (False, True)]
+                paths = [[(tile.row, tile.col) for tile in answer["path"] or []] for _, answer, _ in results]
+                self.assertEqual(results[0][0], results[1][0])
+                self.assertEqual(paths[0], paths[1])
+
+    def test_tile_graph(self):
+        graph = TileGraph(np.arange(12).reshape(3, 4))
+        tile = graph.tile(2, 0)
+        self.assertIsNone(tile.backward)
+        self.assertIsNone(tile.left)
+        self.assertEqual(tile.forward.val, 4)
+        # Tiles are just coordinates, so comparing them works
+        self.assertEqual(tile.forward.right, graph.tile(1, 1))
+        self.assertTrue(graph.tile(0, 3).end)
+        # Forward, backward, left, right
+        self.assertEqual(tile.diffs, (-4, None, None, 1))
+        self.assertFalse(tile.end)
+
+    def test_optimise(self):
+        # Only one way through the puzzle, so nothing to choose between
+        from grid import grid as puzzle_grid
+        for objective in ("min", "max"):
+            result = optimise(puzzle_grid, objective=objective)
+            self.assertEqual(result.solutions[0].score, 1935)
+            self.assertEqual(len(result.solutions[0].path) - 1, 32)
+
+        # Small boards with lots of ways through, checked against trying every one
+        rng = random.Random(0)
+        checked = 0
+        while checked < 10:
+            board = [[rng.choice([0, 0, 0, 1, -1, 2]) for _ in range(3)] for _ in range(3)]
+            board[2][0] = 0
+            everything = solve(board, all_solutions=True, max_moves=8)
+            if len(everything.solutions) < 2:
+                continue
+            checked += 1
+            for objective, best in (("max", max), ("min", min)):
+                with self.subTest(board=board, objective=objective):
+                    result = optimise(board, objective=objective, max_moves=8)
+                    self.assertEqual(result.solutions[0].score, best(solution.score for solution in everything.solutions))
+                    self.assertIn(result.solutions[0], everything.solutions)
+
+    def test_frontier(self):
+        from grid import grid as puzzle_grid
+        result = frontier.solve(puzzle_grid)
+        self.assertEqual(result.solutions, solve(puzzle_grid).solutions)
+
+        # Starting on the end tile needs no moves at all
+        result = frontier.solve(puzzle_grid, start=(2, 3), end=(2, 3))
+        self.assertEqual([solution.path for solution in result.solutions], [[(2, 3)]])
+        self.assertEqual(result.solutions, solve(puzzle_grid, start=(2, 3), end=(2, 3)).solutions)
+
+        # Small faces pack into one int64, big ones don't (and get packed as bytes instead)
+        for max_face in (2, 10**4):
+            for seed in range(5):
+                with self.subTest(max_face=max_face, seed=seed):
+                    board = generate_grid(9, 7, seed=seed, max_face=max_face)
+                    expected = solve(board, max_moves=30).solutions[0]
+                    found = frontier.solve(board, max_moves=30).solutions[0]
+                    self.assertEqual(len(found.path), len(expected.path))
+                    self.assertEqual((found.path[0], found.path[-1]), ((8, 0), (0, 6)))
+
+        # Lots of states per layer, and no way to the end
+        flat = np.zeros((8, 8), dtype=np.int64)
+        flat[0, 7] = 10**9
+        result = frontier.solve(flat, max_moves=10)
+        self.assertEqual(result.solutions, [])
+        self.assertEqual(result.explored, solve(flat, max_moves=10).explored)
+
+    def assert_valid_solution(self, board, solution):
+        """Roll the dice along the path and check every move gets the face the values say it does."""
+        orientation = 0
+        for n, ((row, col), (next_row, next_col)) in enumerate(zip(solution.path, solution.path[1:]), 1):
+            roll = next(roll for roll, d_row, d_col in MOVES if (row + d_row, col + d_col) == (next_row, next_col))
+            orientation = ROLL_TABLE[orientation][roll]
+            self.assertEqual(solution.values[TOP_FACE[orientation]] * n, board[next_row][next_col] - board[row][col])
+
+    def test_bidirectional(self):
+        from grid import grid as puzzle_grid
+        self.assertEqual(solve_bidirectional(puzzle_grid).solutions, solve(puzzle_grid).solutions)
+        self.assertLess(solve_bidirectional(puzzle_grid).explored, solve(puzzle_grid).explored)
+
+        self.assertEqual(join((1, None, 3, None, None, None), (None, 2, 3, None, None, None)), (1, 2, 3, None, None, None))
+        self.assertIsNone(join((1, None, None, None, None, None), (2, None, None, None, None, None)))
+
+        rng = random.Random(1)
+        for trial in range(30):
+            board = [[rng.choice([0, 0, 0, 1, -1, 2]) for _ in range(4)] for _ in range(4)]
+            board[3][0] = 0
+            with self.subTest(board=board):
+                expected = solve(board, max_moves=12).solutions
+                found = solve_bidirectional(board, max_moves=12).solutions
+                self.assertEqual(len(found), len(expected))
+                if not found:
+                    continue
+                path = found[0].path
+                self.assertEqual(len(path), len(expected[0].path))
+                self.assert_valid_solution(board, found[0])
+                self.assertEqual((path[0], path[-1]), ((3, 0), (0, 3)))
+                # The end tile can only be the last one
+                self.assertNotIn((0, 3), path[:-1])
+                # Every move is to a neighbour
+                for (row, col), (next_row, next_col) in zip(path, path[1:]):
+                    self.assertEqual(abs(row - next_row) + abs(col - next_col), 1)
 
+        # Starting on the end tile needs no moves at all
+        for cell in [(2, 3), (5, 0), (0, 5)]:
+            with self.subTest(start=cell, end=cell):
+                expected = solve(puzzle_grid, start=cell, end=cell)
+                self.assertEqual(solve_bidirectional(puzzle_grid, start=cell, end=cell).solutions, expected.solutions)
+                self.assertEqual([solution.path for solution in expected.solutions], [[cell]])
 
+    def test_bad_mode(self):
+        with self.assertRaises(ValueError):
+            solve([[0]], mode="astar")
+        with self.assertRaises(ValueError):
+            optimise([[0]], objective="median")
 
 
 if __name__ == "__main__":
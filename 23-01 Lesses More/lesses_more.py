@@ -1,51 +1,200 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from itertools import product
 from time import time
+from typing import TYPE_CHECKING, NamedTuple, Optional
+import json
+import os
 import numpy as np
 
-def f(a, b, c, d):
+if TYPE_CHECKING:
+    from telemetry import Telemetry
+
+# The 8 symmetries of the square as re-orderings of the corners. The first 4 are
+# the cyclic permutations, the last 4 are the reflections (and their cyclic
+# permutations). f gives the same answer for all of them.
+SYMMETRIES = [
+    (0, 1, 2, 3), (1, 2, 3, 0), (2, 3, 0, 1), (3, 0, 1, 2),
+    (3, 2, 1, 0), (2, 1, 0, 3), (1, 0, 3, 2), (0, 3, 2, 1),
+]
+
+def normalise(a, b, c, d):
+    """Shift (a, b, c, d) so its smallest corner is 0, then pick its lexicographically smallest symmetry."""
+    smallest = min(a, b, c, d)
+    corners = (a - smallest, b - smallest, c - smallest, d - smallest)
+    return min(tuple(corners[i] for i in symmetry) for symmetry in SYMMETRIES)
+
+class TrajectoryCache:
+    """
+    Remembers how many steps f takes from a normalised (a, b, c, d), keeping at
+    most maxsize of them (throwing away the least recently used first).
+    """
+    def __init__(self, maxsize: int = 1_000_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._steps = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._steps)
+
+    def get(self, key) -> Optional[int]:
+        steps = self._steps.get(key)
+        if steps is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._steps.move_to_end(key)
+        return steps
+
+    def put(self, key, steps: int):
+        self._steps[key] = steps
+        self._steps.move_to_end(key)
+        if len(self._steps) > self.maxsize:
+            self._steps.popitem(last=False)
+
+    def clear(self):
+        self._steps.clear()
+        self.hits = 0
+        self.misses = 0
+
+def f(a, b, c, d, cache: Optional[TrajectoryCache] = None):
     steps = 0
+    # Remember where we've been so the cache can learn the rest of the trajectory
+    visited = []
     while (a, b, c, d) != (0, 0, 0, 0):
-        print(a, b, c, d)
+        # f only depends on differences, except for (k, k, k, k) which takes one
+        # step more than (0, 0, 0, 0), so just don't cache those
+        if cache is not None and not a == b == c == d:
+            key = normalise(a, b, c, d)
+            remaining = cache.get(key)
+            if remaining is not None:
+                steps += remaining
+                break
+            visited.append((key, steps))
+
         w = abs(a - b)
         x = abs(b - c)
         y = abs(c - d)
         z = abs(d - a)
         a, b, c, d = w, x, y, z
         steps += 1
-    
-    # Increment to include the final (0, 0, 0, 0) state
-    steps += 1
+    else:
+        # Increment to include the final (0, 0, 0, 0) state
+        steps += 1
+
+    for key, steps_so_far in visited:
+        cache.put(key, steps - steps_so_far)
     return steps
 
-def find_min_sum_max_f(upper_bound: int, print_answers: bool = False):
-    start = time()
+def f_batch(corners: np.ndarray) -> np.ndarray:
+    """Same as f, but for an (N, 4) array of corners at once."""
+    corners = np.asarray(corners, dtype=np.int64)
+    # Every row counts the final (0, 0, 0, 0) state, just like f
+    steps = np.ones(len(corners), dtype=np.int64)
 
-    total_iterations = (upper_bound) ** 4
-    answers = []
-    f_max = 0
-    for i, (a, b, c, d) in enumerate(product(range(upper_bound), range(upper_bound), range(upper_bound), range(upper_bound))):
-        result = f(a, b, c, d)
-        if result > f_max:
-            f_max = result
-            answers = [(a, b, c, d)]
-        elif result == f_max:
-            answers.append((a, b, c, d))
+    # Only keep iterating on the rows that haven't hit (0, 0, 0, 0) yet
+    active = np.flatnonzero(corners.any(axis=1))
+    corners = corners[active]
+    while len(active) > 0:
+        corners = np.abs(corners - np.roll(corners, shift=-1, axis=1))
+        steps[active] += 1
+
+        still_going = corners.any(axis=1)
+        active = active[still_going]
+        corners = corners[still_going]
+
+    return steps
 
-        # if (i + 1) % (total_iterations // 100) == 0:
-        #     print(f"{i + 1}/{total_iterations} ({(i + 1)/total_iterations * 100:.2f}%)")
+def product_chunks(upper_bound: int, chunk_size: int):
+    """Yield every (a, b, c, d) in the same order as itertools.product, as (N, 4) arrays."""
+    total_iterations = upper_bound ** 4
+    for start in range(0, total_iterations, chunk_size):
+        i = np.arange(start, min(start + chunk_size, total_iterations), dtype=np.int64)
+        corners = np.empty((len(i), 4), dtype=np.int64)
+        # Same as itertools.product, i.e. the last corner changes fastest
+        for col in range(3, -1, -1):
+            i, corners[:, col] = np.divmod(i, upper_bound)
+        yield corners
+
+def lexicographically_le(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """Row-wise x <= y for two (N, 4) arrays, comparing like tuples do."""
+    result = np.ones(len(x), dtype=bool)
+    decided = np.zeros(len(x), dtype=bool)
+    for col in range(x.shape[1]):
+        result[~decided & (x[:, col] > y[:, col])] = False
+        decided |= x[:, col] != y[:, col]
+    return result
+
+def canonical_chunks(upper_bound: int, chunk_size: int, start: int = 0, stop: Optional[int] = None):
+    """
+    Yield only one (a, b, c, d) per cyclic/reflected family, in ascending order.
+
+    Since f only depends on the differences between corners, we can also fix
+    a = 0 (see "More thoughts" in the notes), then we only keep the
+    lexicographically smallest ordering of each family, which must start with a
+    zero too.
+
+    Only the (b, c, d) numbered from start up to stop (out of upper_bound ** 3)
+    are checked, so the search can be split into shards.
+    """
+    total_iterations = upper_bound ** 3 if stop is None else stop
+    for chunk_start in range(start, total_iterations, chunk_size):
+        i = np.arange(chunk_start, min(chunk_start + chunk_size, total_iterations), dtype=np.int64)
+        corners = np.zeros((len(i), 4), dtype=np.int64)
+        for col in range(3, 0, -1):
+            i, corners[:, col] = np.divmod(i, upper_bound)
+
+        is_canonical = np.ones(len(corners), dtype=bool)
+        for symmetry in SYMMETRIES[1:]:
+            is_canonical &= lexicographically_le(corners, corners[:, symmetry])
+        yield corners[is_canonical]
+
+def record_steps(telemetry: "Telemetry", results: np.ndarray):
+    """Count every (a, b, c, d) as a node, with how many steps f took as its depth."""
+    for steps, count in enumerate(np.bincount(results).tolist()):
+        if count:
+            telemetry.node(depth=steps, count=count)
+
+def find_min_sum_max_f(upper_bound: int, print_answers: bool = False, chunk_size: int = 1_000_000, reduce_symmetry: bool = True, cache: Optional[TrajectoryCache] = None, telemetry: Optional["Telemetry"] = None):
+    start = time()
 
-    # Reduce to only the *unique* solutions
-    answers_copy = answers.copy()
     answers = []
-    for (a, b, c, d) in answers_copy:
-        # Discard cyclic permutations
-        if (b, c, d, a) in answers or (c, d, a, b) in answers or (d, a, b, c) in answers:
+    f_max = 0
+    evaluated = 0
+    chunks = canonical_chunks if reduce_symmetry else product_chunks
+    for corners in chunks(upper_bound, chunk_size):
+        if len(corners) == 0:
             continue
-        # Discard reflections (and their cyclic permutations)
-        if (d, c, b, a) in answers or (c, b, a, d) in answers or (b, a, d, c) in answers or (a, d, c, b) in answers:
+        if cache is None:
+            results = f_batch(corners)
+        else:
+            results = np.array([f(*row, cache=cache) for row in corners.tolist()])
+        evaluated += len(corners)
+        if telemetry is not None:
+            record_steps(telemetry, results)
+        chunk_max = results.max()
+        if chunk_max < f_max:
             continue
+        if chunk_max > f_max:
+            f_max = int(chunk_max)
+            answers = []
+        answers.extend(map(tuple, corners[results == f_max].tolist()))
 
-        answers.append((a, b, c, d))
+    # Reduce to only the *unique* solutions (canonical_chunks already did this)
+    if not reduce_symmetry:
+        answers_copy = answers.copy()
+        answers = []
+        for (a, b, c, d) in answers_copy:
+            # Discard cyclic permutations
+            if (b, c, d, a) in answers or (c, d, a, b) in answers or (d, a, b, c) in answers:
+                continue
+            # Discard reflections (and their cyclic permutations)
+            if (d, c, b, a) in answers or (c, b, a, d) in answers or (b, a, d, c) in answers or (a, d, c, b) in answers:
+                continue
+
+            answers.append((a, b, c, d))
 
     print(f"Found {len(answers)} unique candidates that yield a maximum $f$ of {f_max}. Finding minimum sum of corners now...")
     if print_answers:
@@ -64,6 +213,257 @@ def find_min_sum_max_f(upper_bound: int, print_answers: bool = False):
     end = time()
     duration_seconds = end - start
     print(f"Upper bound of {upper_bound:>4}: min sum = {min_sum}: {min_sol}    [{duration_seconds:.2f} seconds]")
+    if cache is not None:
+        print(f"Trajectory cache: {cache.hits} hits, {cache.misses} misses, {len(cache)}/{cache.maxsize} entries")
+    if telemetry is not None:
+        # Everything canonical_chunks skipped is the same as something it didn't
+        telemetry.prune("symmetry", upper_bound ** 4 - evaluated)
+        if cache is not None:
+            telemetry.count("cache hits", cache.hits)
+            telemetry.count("cache misses", cache.misses)
+        telemetry.report("done", upper_bound=upper_bound, f_max=f_max, min_sum=min_sum, min_sol=min_sol)
+    return f_max, min_sum, min_sol
+
+
+# Every choice of signs for (b - a, c - b, d - c, a - d)
+SIGNS = np.array(list(product((1, -1), repeat=4)), dtype=np.int64)
+
+class SweepSummary(NamedTuple):
+    """The best corners found in (part of) a sweep. Summaries can be merged in any order."""
+    f_max: int = 0
+    min_sum: int = 0
+    min_sol: Optional[tuple] = None
+
+    def merge(self, other: "SweepSummary") -> "SweepSummary":
+        # Largest f first, then smallest sum, then the same tie-break as find_min_sum_max_f
+        return min(self, other, key=lambda summary: (-summary.f_max, summary.min_sum, summary.min_sol or ()))
+
+def sweep_shard(upper_bound: int, start: int, stop: int, chunk_size: int = 1_000_000) -> SweepSummary:
+    summary = SweepSummary()
+    for corners in canonical_chunks(upper_bound, chunk_size, start=start, stop=stop):
+        if len(corners) == 0:
+            continue
+        results = f_batch(corners)
+        chunk_max = int(results.max())
+        min_sum, min_sol = min_sum_corners(corners[results == chunk_max])
+        summary = summary.merge(SweepSummary(chunk_max, min_sum, min_sol))
+    return summary
+
+def find_min_sum_max_f_parallel(upper_bound: int, num_shards: Optional[int] = None, max_workers: Optional[int] = None, chunk_size: int = 1_000_000, checkpoint_dir: Optional[str] = None) -> SweepSummary:
+    """
+    Same as find_min_sum_max_f, but split into shards that are swept by a pool of
+    processes.
+
+    If checkpoint_dir is given, every finished shard is saved there, and shards
+    that were already saved (e.g. before a crash) are not swept again.
+    """
+    start = time()
+
+    total_iterations = upper_bound ** 3
+    if num_shards is None:
+        num_shards = 4 * (os.cpu_count() or 1)
+    shard_bounds = [total_iterations * i // num_shards for i in range(num_shards + 1)]
+    shards = [(lo, hi) for lo, hi in zip(shard_bounds[:-1], shard_bounds[1:]) if lo < hi]
+
+    summary = SweepSummary()
+    pending = []
+    for shard_start, shard_stop in shards:
+        checkpoint = load_shard_checkpoint(checkpoint_dir, upper_bound, shard_start, shard_stop)
+        if checkpoint is None:
+            pending.append((shard_start, shard_stop))
+        else:
+            summary = summary.merge(checkpoint)
+
+    print(f"Sweeping {len(pending)}/{len(shards)} shards ({len(shards) - len(pending)} already checkpointed)")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(sweep_shard, upper_bound, shard_start, shard_stop, chunk_size): (shard_start, shard_stop)
+            for shard_start, shard_stop in pending
+        }
+        for future in as_completed(futures):
+            shard_start, shard_stop = futures[future]
+            shard_summary = future.result()
+            save_shard_checkpoint(checkpoint_dir, upper_bound, shard_start, shard_stop, shard_summary)
+            summary = summary.merge(shard_summary)
+
+    end = time()
+    duration_seconds = end - start
+    print(f"Upper bound of {upper_bound:>4}: max f = {summary.f_max}: min sum = {summary.min_sum}: {summary.min_sol}    [{duration_seconds:.2f} seconds]")
+    return summary
+
+def shard_checkpoint_path(checkpoint_dir: str, upper_bound: int, shard_start: int, shard_stop: int) -> str:
+    return os.path.join(checkpoint_dir, f"upper_bound_{upper_bound}_shard_{shard_start}_{shard_stop}.json")
+
+def save_shard_checkpoint(checkpoint_dir: Optional[str], upper_bound: int, shard_start: int, shard_stop: int, summary: SweepSummary):
+    if checkpoint_dir is None:
+        return
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = shard_checkpoint_path(checkpoint_dir, upper_bound, shard_start, shard_stop)
+    # Write somewhere else first so a crash can't leave half a checkpoint behind
+    with open(path + ".tmp", "w") as file:
+        json.dump(summary._asdict(), file)
+    os.replace(path + ".tmp", path)
+
+def load_shard_checkpoint(checkpoint_dir: Optional[str], upper_bound: int, shard_start: int, shard_stop: int) -> Optional[SweepSummary]:
+    if checkpoint_dir is None:
+        return None
+
+    path = shard_checkpoint_path(checkpoint_dir, upper_bound, shard_start, shard_stop)
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        checkpoint = json.load(file)
+    min_sol = tuple(checkpoint["min_sol"]) if checkpoint["min_sol"] is not None else None
+    return SweepSummary(checkpoint["f_max"], checkpoint["min_sum"], min_sol)
+
+
+def canonicalise(corners: np.ndarray) -> np.ndarray:
+    """Same as normalise, but for every row of an (N, 4) array."""
+    corners = corners - corners.min(axis=1, keepdims=True)
+    best = corners
+    for symmetry in SYMMETRIES[1:]:
+        other = corners[:, symmetry]
+        best = np.where(lexicographically_le(best, other)[:, None], best, other)
+    return best
+
+def preimages(corners: np.ndarray, upper_bound: int, chunk_size: int = 5_000) -> np.ndarray:
+    """
+    Return every canonical (a, b, c, d) under upper_bound that becomes some
+    multiple of a translation of one of the given rows after a single step of f.
+
+    For a fixed choice of signs, undoing the absolute values is just a linear
+    system: b - a = s0 * w, c - b = s1 * x, d - c = s2 * y and a - d = s3 * z.
+    Fixing a = 0 (any other a is just a translation), this has a solution
+    exactly when s0 * w + s1 * x + s2 * y + s3 * z = 0.
+
+    The rows are canonical, so the image can be any m * (w, x, y, z) + k with
+    m >= 1 and k >= 0. When the signs don't sum to zero, that fixes k / m.
+    When they do, the row's signed sum has to be zero and then every k works.
+    Only coprime m and k need trying (anything else is a multiple of one of
+    those), and then the preimage has no common factor either, so its largest
+    corner is at least m * max(w, x, y, z) + k. That bounds both.
+
+    There can be a lot of them, so this goes chunk_size rows at a time and
+    keeps each preimage found packed into a single int64 (which fits for an
+    upper_bound up to 55,000).
+    """
+    found = np.empty(0, dtype=np.int64)
+    pending = []
+    for begin in range(0, len(corners), chunk_size):
+        previous = preimages_of_chunk(corners[begin:begin + chunk_size], upper_bound)
+        keys = ((previous[:, 0] * upper_bound + previous[:, 1]) * upper_bound + previous[:, 2]) * upper_bound + previous[:, 3]
+        pending.append(sorted_unique(keys))
+        # Only merging once there's as much again to add stops this sorting found over and over
+        if sum(map(len, pending)) > len(found):
+            found = sorted_unique(np.concatenate([found] + pending))
+            pending = []
+    found = sorted_unique(np.concatenate([found] + pending))
+
+    previous = np.empty((len(found), 4), dtype=np.int64)
+    for corner in range(3, -1, -1):
+        found, previous[:, corner] = np.divmod(found, upper_bound)
+    return previous
+
+def sorted_unique(keys: np.ndarray) -> np.ndarray:
+    """Same as np.unique for a 1D array, but just sorting, which is quicker for lots of int64s."""
+    keys = np.sort(keys)
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return keys[first]
+
+def preimages_of_chunk(corners: np.ndarray, upper_bound: int) -> np.ndarray:
+    """Same as preimages, for a few rows at a time, and the preimages can come out more than once."""
+    sign_totals = SIGNS.sum(axis=1)
+    signed_sums = corners @ SIGNS.T
+    # (w + k, x + k, y + k, z + k) closes when signed_sum + k * sign_total == 0
+    scales = np.where(sign_totals == 0, 1, np.abs(sign_totals))
+    shifts = -signed_sums * np.sign(sign_totals)
+    rows, signs = np.nonzero((sign_totals != 0) & (shifts >= 0))
+    images = [corners[rows] * scales[signs, None] + shifts[rows, signs, None]]
+    image_signs = [signs]
+
+    rows, signs = np.nonzero((sign_totals == 0) & (signed_sums == 0))
+    tops = corners[rows].max(axis=1)
+    shifts = np.arange(upper_bound)
+    for scale in range(1, upper_bound):
+        fits = scale * tops < upper_bound
+        if not fits.any():
+            break
+        rows, signs, tops = rows[fits], signs[fits], tops[fits]
+        ok = (shifts < upper_bound - scale * tops[:, None]) & (np.gcd(shifts, scale) == 1)
+        which, shift = np.nonzero(ok)
+        images.append(corners[rows[which]] * scale + shift[:, None])
+        image_signs.append(signs[which])
+
+    image = np.concatenate(images)
+    signs = np.concatenate(image_signs)
+    previous = np.zeros((len(image), 4), dtype=np.int64)
+    previous[:, 1:] = np.cumsum(image[:, :3] * SIGNS[signs, :3], axis=1)
+    if len(previous) == 0:
+        return previous
+
+    previous = canonicalise(previous)
+    # f(k*a, k*b, k*c, k*d) == f(a, b, c, d), so the smallest version is all we need
+    previous //= np.gcd.reduce(previous, axis=1)[:, None]
+    return previous[previous.max(axis=1) < upper_bound]
+
+def backward_levels(upper_bound: int):
+    """
+    Yield (steps, corners) for every canonical tuple under upper_bound with
+    f(a, b, c, d) == steps (and no common factor), by working backwards from
+    (0, 0, 0, 0) with preimages.
+
+    Anything that reaches (0, 0, 0, 0) goes through some (k, k, k, k) first, and
+    since f(k*a, k*b, k*c, k*d) == f(a, b, c, d) we only need to go backwards
+    from (1, 1, 1, 1). Going backwards can never make the largest corner
+    smaller, so we can drop anything that is already too big.
+    """
+    level = np.zeros((1, 4), dtype=np.int64)
+    steps = 1
+    while True:
+        level = level[level.max(axis=1) < upper_bound]
+        if len(level) == 0:
+            return
+        yield steps, level
+
+        if steps == 1:
+            level = np.ones((1, 4), dtype=np.int64)
+        else:
+            level = preimages(level, upper_bound)
+        steps += 1
+
+def min_sum_corners(corners: np.ndarray):
+    """Return the row with the smallest sum, breaking ties like the forward search does."""
+    sums = corners.sum(axis=1)
+    # np.lexsort uses the *last* key as the primary one
+    order = np.lexsort(corners.T[::-1])
+    best = order[np.argmin(sums[order])]
+    return int(sums[best]), tuple(corners[best].tolist())
+
+def find_min_sum_for_f(steps: int, upper_bound: int):
+    """Return (min_sum, corners) for the smallest corners under upper_bound with f == steps, or None."""
+    for level_steps, corners in backward_levels(upper_bound):
+        if level_steps == steps:
+            return min_sum_corners(corners)
+    return None
+
+def find_min_sum_max_f_backward(upper_bound: int, telemetry: Optional["Telemetry"] = None):
+    start = time()
+
+    f_max, min_sum, min_sol = 0, upper_bound * 4, None
+    for steps, corners in backward_levels(upper_bound):
+        f_max = steps
+        min_sum, min_sol = min_sum_corners(corners)
+        if telemetry is not None:
+            telemetry.node(depth=steps, count=len(corners))
+
+    end = time()
+    duration_seconds = end - start
+    print(f"Upper bound of {upper_bound:>4}: max f = {f_max}: min sum = {min_sum}: {min_sol}    [{duration_seconds:.2f} seconds]")
+    if telemetry is not None:
+        telemetry.report("done", upper_bound=upper_bound, f_max=f_max, min_sum=min_sum, min_sol=min_sol)
+    return f_max, min_sum, min_sol
 
 
 def f2(l):
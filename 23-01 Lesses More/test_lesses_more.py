@@ -0,0 +1,143 @@
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+from lesses_more import (f, f_batch, find_min_sum_max_f, find_min_sum_max_f_backward, find_min_sum_max_f_parallel, find_min_sum_for_f,
+                         backward_levels, normalise, product_chunks, canonical_chunks, TrajectoryCache, SweepSummary)
+
+
+def quietly(function, *args, **kwargs):
+    """Call function without letting it print anything."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+class TestLessesMore(unittest.TestCase):
+    def test_f(self):
+        self.assertEqual(f(0, 0, 0, 0), 1)
+        self.assertEqual(f(1, 1, 1, 1), 2)
+        self.assertEqual(f(0, 0, 0, 1), 5)
+        self.assertEqual(f(0, 2, 6, 13), 11)
+
+    def test_f_batch(self):
+        for corners in product_chunks(6, chunk_size=500):
+            expected = [f(*row) for row in corners.tolist()]
+            self.assertEqual(f_batch(corners).tolist(), expected)
+
+        rng = random.Random(0)
+        corners = np.array([[rng.randint(0, 10_000) for _ in range(4)] for _ in range(1000)])
+        self.assertEqual(f_batch(corners).tolist(), [f(*row) for row in corners.tolist()])
+
+        # Same order as itertools.product
+        self.assertEqual([tuple(row) for chunk in product_chunks(3, chunk_size=7) for row in chunk.tolist()],
+                         [(a, b, c, d) for a in range(3) for b in range(3) for c in range(3) for d in range(3)])
+
+    def test_cached_f(self):
+        rng = random.Random(1)
+        # Small enough that plenty of trajectories get evicted along the way
+        cache = TrajectoryCache(maxsize=100)
+        for _ in range(2000):
+            corners = [rng.randint(0, 50) for _ in range(4)]
+            with self.subTest(corners=corners):
+                self.assertEqual(f(*corners, cache=cache), f(*corners))
+        self.assertGreater(cache.hits, 0)
+        self.assertLessEqual(len(cache), cache.maxsize)
+
+        for upper_bound in (5, 12):
+            with self.subTest(upper_bound=upper_bound):
+                self.assertEqual(quietly(find_min_sum_max_f, upper_bound, cache=TrajectoryCache(maxsize=50)),
+                                 quietly(find_min_sum_max_f, upper_bound))
+
+    def test_trajectory_cache_evicts_least_recently_used(self):
+        cache = TrajectoryCache(maxsize=2)
+        cache.put((0, 0, 0, 1), 5)
+        cache.put((0, 0, 1, 1), 4)
+        self.assertEqual(cache.get((0, 0, 0, 1)), 5)
+        cache.put((0, 1, 0, 1), 3)
+        self.assertIsNone(cache.get((0, 0, 1, 1)))
+        self.assertEqual(cache.get((0, 0, 0, 1)), 5)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        # Every symmetry and translation of a tuple shares one entry
+        self.assertEqual({normalise(*corners) for corners in [(3, 5, 9, 4), (5, 9, 4, 3), (4, 9, 5, 3), (13, 15, 19, 14)]}, {(0, 1, 6, 2)})
+
+    def test_canonical_chunks(self):
+        for upper_bound in range(1, 8):
+            with self.subTest(upper_bound=upper_bound):
+                canonical = [tuple(row) for chunk in canonical_chunks(upper_bound, chunk_size=50) for row in chunk.tolist()]
+                # One of each family, in ascending order
+                expected = sorted({normalise(*corners) for corners in itertools.product(range(upper_bound), repeat=4)})
+                self.assertEqual(canonical, expected)
+
+                # Shards cover the same tuples between them
+                middle = upper_bound ** 3 // 2
+                sharded = [tuple(row) for start, stop in [(0, middle), (middle, upper_bound ** 3)]
+                           for chunk in canonical_chunks(upper_bound, chunk_size=50, start=start, stop=stop) for row in chunk.tolist()]
+                self.assertEqual(sharded, canonical)
+
+    def test_sweeps_agree(self):
+        for upper_bound in range(1, 21):
+            with self.subTest(upper_bound=upper_bound):
+                expected = quietly(find_min_sum_max_f, upper_bound, reduce_symmetry=False)
+                self.assertEqual(quietly(find_min_sum_max_f, upper_bound), expected)
+                self.assertEqual(quietly(find_min_sum_max_f_backward, upper_bound), expected)
+
+    def test_backward_levels_are_complete(self):
+        upper_bound = 12
+        by_steps = {}
+        for chunk in canonical_chunks(upper_bound, chunk_size=1000):
+            for corners, steps in zip(chunk.tolist(), f_batch(chunk).tolist()):
+                by_steps.setdefault(steps, []).append(tuple(corners))
+
+        for steps, corners in backward_levels(upper_bound):
+            # The first two levels are (0, 0, 0, 0) and (1, 1, 1, 1), which canonical_chunks can't tell apart
+            if steps < 3:
+                continue
+            with self.subTest(steps=steps):
+                # Multiples of a tuple take the same number of steps, so only the smallest ones are kept
+                expected = sorted(row for row in by_steps.pop(steps) if np.gcd.reduce(row) == 1)
+                self.assertEqual(sorted(map(tuple, corners.tolist())), expected)
+                self.assertEqual(find_min_sum_for_f(steps, upper_bound), min((sum(row), row) for row in expected))
+        # Every f the forward sweep saw has a level
+        self.assertLessEqual(set(by_steps), {1, 2})
+
+    def test_parallel_sweep(self):
+        summaries = [SweepSummary(9, 30, (0, 1, 5, 24)), SweepSummary(9, 30, (0, 1, 4, 25)), SweepSummary(8, 3, (0, 0, 1, 2)), SweepSummary()]
+        for order in itertools.permutations(summaries):
+            merged = SweepSummary()
+            for summary in order:
+                merged = merged.merge(summary)
+            self.assertEqual(merged, SweepSummary(9, 30, (0, 1, 4, 25)))
+
+        for upper_bound in (1, 7, 15):
+            with self.subTest(upper_bound=upper_bound):
+                expected = quietly(find_min_sum_max_f, upper_bound)
+                self.assertEqual(tuple(quietly(find_min_sum_max_f_parallel, upper_bound, num_shards=5, max_workers=2, chunk_size=100)), expected)
+
+    def test_parallel_sweep_resumes_from_checkpoints(self):
+        expected = quietly(find_min_sum_max_f, 9)
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            self.assertEqual(tuple(quietly(find_min_sum_max_f_parallel, 9, num_shards=4, max_workers=2, checkpoint_dir=checkpoint_dir)), expected)
+            paths = sorted(os.listdir(checkpoint_dir))
+            self.assertEqual(len(paths), 4)
+
+            # Shards that are already saved get read back rather than swept again
+            with open(os.path.join(checkpoint_dir, paths[0]), "w") as file:
+                json.dump(SweepSummary(99, 1, (0, 0, 0, 1))._asdict(), file)
+            os.remove(os.path.join(checkpoint_dir, paths[1]))
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                resumed = find_min_sum_max_f_parallel(9, num_shards=4, max_workers=2, checkpoint_dir=checkpoint_dir)
+            self.assertEqual(resumed, SweepSummary(99, 1, (0, 0, 0, 1)))
+            self.assertIn("Sweeping 1/4 shards", output.getvalue())
+            self.assertEqual(sorted(os.listdir(checkpoint_dir)), paths)
+
+
+if __name__ == "__main__":
+    unittest.main()
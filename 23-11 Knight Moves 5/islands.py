@@ -0,0 +1,132 @@
+from collections import deque
+import typing
+
+
+def joined(altitudes: list, unit, cell: int, target: int, alt_diff: int) -> bool:
+    """Return True if the knight can jump from cell to target and back again."""
+    return altitudes[target] == altitudes[cell] + alt_diff * unit and altitudes[cell] == altitudes[target] - alt_diff * unit
+
+
+class IslandMap:
+    """Which island every (flattened) cell is on, for one grid of altitudes.
+
+    An island is a group of cells the knight can get between by jumping alone,
+    without sleeping. Jumps work both ways (the jump back needs the opposite
+    change in altitude), so these are just the connected components of the
+    cells joined by the jumps that are valid right now. On float grids rounding
+    can make a jump only work one way, so only jumps that work both ways count,
+    and exact says whether the altitudes are exact (see ExactGrid) instead.
+
+    neighbours[cell] lists (target cell, altitude difference) for every knight
+    move from cell. A map is never changed once built: updated() makes a new
+    one (sharing labels with this one if no jumps changed), so a search can
+    undo a sleep by going back to the old map.
+    """
+
+    def __init__(self, altitudes: list, unit, neighbours: list[list[tuple[int, int]]], labels: list[int], exact: bool = False):
+        self.altitudes = altitudes
+        self.unit = unit
+        self.exact = exact
+        self.neighbours = neighbours
+        # Every cell's label is one of the cells on its island
+        self.labels = labels
+
+    def joined(self, cell: int, target: int, alt_diff: int) -> bool:
+        return joined(self.altitudes, self.unit, cell, target, alt_diff)
+
+    @classmethod
+    def build(cls, altitudes: list, unit, neighbours: list[list[tuple[int, int]]], exact: bool = False) -> "IslandMap":
+        """Find every island from scratch, using union-find."""
+        parent = list(range(len(altitudes)))
+
+        def find(cell: int) -> int:
+            while parent[cell] != cell:
+                parent[cell] = parent[parent[cell]]
+                cell = parent[cell]
+            return cell
+
+        for cell in range(len(altitudes)):
+            for target, alt_diff in neighbours[cell]:
+                if target > cell and joined(altitudes, unit, cell, target, alt_diff):
+                    parent[find(target)] = find(cell)
+
+        return cls(altitudes, unit, neighbours, [find(cell) for cell in range(len(altitudes))], exact)
+
+    def updated(self, altitudes: list, changed: typing.Iterable[int]) -> "IslandMap":
+        """Return the map for the new altitudes, where only the changed cells moved.
+
+        Only jumps to or from a changed cell can have appeared or disappeared.
+        An island that lost a jump might have split, so only those islands are
+        searched again (with a BFS), and islands that gained a jump are joined.
+        """
+        changed = set(changed)
+        # Cells that moved together keep their jumps between each other (on
+        # exact grids, anyway, where nothing gets rounded)
+        exact = self.exact
+        added = []
+        removed = []
+        for cell in changed:
+            shift = altitudes[cell] - self.altitudes[cell]
+            for target, alt_diff in self.neighbours[cell]:
+                if target in changed and (target < cell or exact and altitudes[target] - self.altitudes[target] == shift):
+                    # Already checked from the other end, or can't have changed
+                    continue
+                was_joined = self.joined(cell, target, alt_diff)
+                if was_joined != joined(altitudes, self.unit, cell, target, alt_diff):
+                    (removed if was_joined else added).append((cell, target))
+
+        if not added and not removed:
+            return IslandMap(altitudes, self.unit, self.neighbours, self.labels, self.exact)
+
+        labels = list(self.labels)
+        stale = {labels[cell] for cell, _ in removed}
+        cells = [cell for cell, label in enumerate(self.labels) if label in stale]
+        for cell in cells:
+            labels[cell] = -1
+        for start in cells:
+            if labels[start] != -1:
+                continue
+            labels[start] = start
+            queue = deque([start])
+            while queue:
+                cell = queue.popleft()
+                for target, alt_diff in self.neighbours[cell]:
+                    if labels[target] == -1 and joined(altitudes, self.unit, cell, target, alt_diff):
+                        labels[target] = start
+                        queue.append(target)
+
+        for cell, target in added:
+            label, other_label = labels[cell], labels[target]
+            if label != other_label:
+                labels = [label if old_label == other_label else old_label for old_label in labels]
+
+        return IslandMap(altitudes, self.unit, self.neighbours, labels, self.exact)
+
+    def same_island(self, cell: int, other: int) -> bool:
+        return self.labels[cell] == self.labels[other]
+
+    def route(self, start: int, end: int, blocked: int = 0) -> typing.Optional[list[int]]:
+        """Return the cells to jump through (after start, up to and including end)
+        to get from start to end without sleeping, or None if we can't.
+
+        blocked is a bitmask of cells we're not allowed to jump onto, e.g. the
+        ones already visited at this time.
+        """
+        if not self.same_island(start, end):
+            return None
+
+        came_from = {start: None}
+        queue = deque([start])
+        while queue:
+            cell = queue.popleft()
+            if cell == end:
+                route = []
+                while cell != start:
+                    route.append(cell)
+                    cell = came_from[cell]
+                return route[::-1]
+            for target, alt_diff in self.neighbours[cell]:
+                if target not in came_from and not blocked & (1 << target) and self.joined(cell, target, alt_diff):
+                    came_from[target] = cell
+                    queue.append(target)
+        return None
@@ -1,202 +1,1127 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fractions import Fraction
+from multiprocessing import Manager
 from string import ascii_lowercase
 import typing
+import copy
+import functools
+import heapq
 import itertools
+import math
 import time
 import random
 
 import numpy as np
 
+from islands import IslandMap
+from transposition import SharedTranspositionTable, TranspositionTable, ZobristHasher
+
+if typing.TYPE_CHECKING:
+    from telemetry import Telemetry
+
+
+class ExactGrid:
+    """Grid of altitudes stored exactly as int64 numerators over one common denominator.
+
+    Every sleep moves cells by 1/n, so the denominator only has to be a
+    multiple of the n's the search has actually slept with. It starts at 1,
+    and refine() scales it (and every numerator) up the first time a sleep
+    needs a new factor, so every altitude stays a whole number of
+    1/denominator steps and comparing altitudes is always exact. Allowing for
+    every n up front (lcm(1, 2, ..., number of cells)) would overflow int64 on
+    anything bigger than 6x6.
+    """
+
+    def __init__(self, numerators: np.ndarray, denominator: int):
+        self.numerators = numerators
+        self.denominator = denominator
+
+    @classmethod
+    def from_altitudes(cls, altitudes) -> "ExactGrid":
+        altitudes = np.asarray(altitudes)
+        if not np.array_equal(altitudes, np.round(altitudes)):
+            raise ValueError("Starting altitudes must be whole numbers")
+
+        return cls(altitudes.astype(np.int64), 1)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.numerators.shape
+
+    def copy(self) -> "ExactGrid":
+        return ExactGrid(self.numerators.copy(), self.denominator)
+
+    def refine(self, n: int) -> int:
+        """Scale the denominator up (in place) so that 1/n is a whole number of
+        steps, and return the factor it went up by (1 if it already was)."""
+        factor = n // math.gcd(self.denominator, n)
+        if factor > 1:
+            # Leave plenty of headroom for cells sinking/rising during the search
+            if (int(np.abs(self.numerators).max(initial=0)) + self.numerators.size * self.denominator) * factor >= 2**62:
+                raise OverflowError(f"Altitudes over a denominator of {self.denominator * factor} don't fit in int64")
+            self.numerators *= factor
+            self.denominator *= factor
+        return factor
+
+    def coarsen(self, factor: int):
+        """Undo refine(), once every numerator is a multiple of factor again."""
+        self.numerators //= factor
+        self.denominator //= factor
+
+    def __getitem__(self, index) -> Fraction:
+        return Fraction(int(self.numerators[index]), self.denominator)
+
+    def to_fractions(self) -> np.ndarray:
+        fractions = np.empty(self.shape, dtype=object)
+        for index, numerator in np.ndenumerate(self.numerators):
+            fractions[index] = Fraction(int(numerator), self.denominator)
+        return fractions
+
+    def __str__(self) -> str:
+        return np.array2string(self.to_fractions(), formatter={"all": str})
+
 
 # Some common type aliases
-Grid = np.ndarray[float]
+Grid = typing.Union[np.ndarray, ExactGrid]
 Time = int
 Position = [int, int]
 KnightState = tuple[Time, Position]
 
-search_count = 0
-roadblock_count = 0
 leniency_factor = 20
 
 
-def get_opposite_position(grid: Grid, position: Position) -> Position:
-    height, width = grid.shape
-    row, col = position
-    opp_row = height - row - 1
-    opp_col = width - col - 1
-    return opp_row, opp_col
-
-
-def update_grid(grid: Grid, position: Position) -> Grid:
-    # Get indices of cells with same altitude
-    row, col = position
-    altitude = grid[row, col]
-    indices = np.transpose((grid == altitude).nonzero())
-
-    # This discards diametrically opposite cell since it shouldn't count
-    opposite_position = get_opposite_position(grid, position)
-    opposite_match = np.all(indices == opposite_position, axis=1)
-    opposite_was_same_alt = np.count_nonzero(opposite_match) > 0
-    indices = indices[~opposite_match]
-    n = len(indices)
-
-    # Rise all cells with same altitude
-    rate = 1 / n
-    rows, cols = indices.transpose()
-    updated_grid = grid.copy()
-    updated_grid[rows, cols] -= rate
-
-    # Sink diametrically opposite cell if it wasn't same altitude
-    if not opposite_was_same_alt:
-        opp_row, opp_col = opposite_position
-        updated_grid[opp_row, opp_col] += rate
-
-    return updated_grid
-
-def search_for_action(action: KnightState, path: list[KnightState]) -> bool:
-    """Return True if given action is already in path, False otherwise.
-    
-    Note we know that our path is sorted in ascending time order, so we only need
-    to search backwards until the time time drops below that of the given action.
+def get_altitudes(grid: Grid) -> tuple[np.ndarray, typing.Union[int, float]]:
+    """Return the raw array of altitudes, and what an altitude of 1 looks like in it."""
+    if isinstance(grid, ExactGrid):
+        return grid.numerators, grid.denominator
+    return grid, 1
+
+
+class NeighbourTable(typing.NamedTuple):
+    """Every knight move from every (flattened) cell of a board of some shape.
+
+    cell_targets[cell] and cell_alt_diffs[cell] list the in-bounds target cells
+    and the altitude difference each jump needs (in the same order as the
+    search has always tried them).
+    """
+    cell_targets: tuple[np.ndarray, ...]
+    cell_alt_diffs: tuple[np.ndarray, ...]
+    opposites: np.ndarray
+
+
+@functools.lru_cache(maxsize=None)
+def get_neighbour_table(shape: tuple[int, int]) -> NeighbourTable:
+    height, width = shape
+    valid_combos = [(0, 1, 2), (0, 1, -2), (0, -1, 2), (0, -1, -2)]
+    moves = [perm for combo in valid_combos for perm in itertools.permutations(combo)]
+
+    targets = np.full((height * width, len(moves)), -1, dtype=np.intp)
+    alt_diffs = np.zeros((height * width, len(moves)), dtype=np.int64)
+    for row in range(height):
+        for col in range(width):
+            for i, (row_diff, col_diff, alt_diff) in enumerate(moves):
+                new_row = row + row_diff
+                new_col = col + col_diff
+                if 0 <= new_row < height and 0 <= new_col < width:
+                    targets[row * width + col, i] = new_row * width + new_col
+                    alt_diffs[row * width + col, i] = alt_diff
+
+    in_bounds = targets >= 0
+    cell_targets = tuple(cell_targets[ok] for cell_targets, ok in zip(targets, in_bounds))
+    cell_alt_diffs = tuple(cell_alt_diffs[ok] for cell_alt_diffs, ok in zip(alt_diffs, in_bounds))
+    # Diametrically opposite cell is the mirror image in the flattened grid too
+    opposites = np.arange(height * width)[::-1].copy()
+    return NeighbourTable(cell_targets, cell_alt_diffs, opposites)
+
+
+@functools.lru_cache(maxsize=None)
+def get_neighbour_lists(shape: tuple[int, int]) -> list[list[tuple[int, int]]]:
+    """Same moves as get_neighbour_table, as plain (target cell, altitude difference) lists."""
+    table = get_neighbour_table(shape)
+    return [list(zip(targets.tolist(), alt_diffs.tolist())) for targets, alt_diffs in zip(table.cell_targets, table.cell_alt_diffs)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_hasher(num_cells: int) -> ZobristHasher:
+    """Zobrist keys for a board of num_cells cells, shared by every state on it
+    (the keys only depend on the seed, so each search would make the same ones)."""
+    return ZobristHasher(num_cells)
+
+
+def find_jumps(altitudes: np.ndarray, cell: int, unit) -> list[int]:
+    """Return the cells the knight could jump to from cell right now.
+
+    There are at most 8 moves to check, so plain lookups beat building arrays
+    for them.
+    """
+    flat_altitudes = altitudes.reshape(-1)
+    altitude = flat_altitudes.item(cell)
+    return [target for target, alt_diff in get_neighbour_lists(altitudes.shape)[cell]
+            if flat_altitudes.item(target) == altitude + alt_diff * unit]
+
+
+def check_if_reachable(grid: Grid, target_pos: Position, leniency: typing.Optional[float] = None) -> bool:
+    """Return True if target position seems reachable now or in the future.
+
+    This is only a guess (see LeniencyPruner), using leniency_factor unless
+    leniency is given.
+    """
+    if leniency is None:
+        leniency = leniency_factor
+    row, col = target_pos
+    altitudes, unit = get_altitudes(grid)
+    flat_altitudes = altitudes.reshape(-1)
+    table = get_neighbour_table(grid.shape)
+    cell = row * grid.shape[1] + col
+
+    actual_diffs = flat_altitudes[cell] - flat_altitudes[table.cell_targets[cell]]
+    return bool(np.any(actual_diffs < leniency * table.cell_alt_diffs[cell] * unit))
+
+
+class AltitudeIndex:
+    """Keeps track of which (flattened) cells are at each altitude, so we never
+    have to scan the whole grid to find them."""
+
+    def __init__(self, altitudes: np.ndarray):
+        self._cells = {}
+        for cell, altitude in enumerate(altitudes.reshape(-1).tolist()):
+            self._cells.setdefault(altitude, set()).add(cell)
+
+    def cells_at(self, altitude) -> set[int]:
+        return self._cells.get(altitude, set())
+
+    def move(self, cells: typing.Iterable[int], old_altitude, new_altitude):
+        old_cells = self._cells[old_altitude]
+        old_cells.difference_update(cells)
+        if not old_cells:
+            del self._cells[old_altitude]
+        self._cells.setdefault(new_altitude, set()).update(cells)
+
+    def move_all(self, old_altitude, new_altitude):
+        """Move every cell at old_altitude, i.e. a group that is sinking together."""
+        cells = self._cells.pop(old_altitude)
+        if new_altitude in self._cells:
+            self._cells[new_altitude].update(cells)
+        else:
+            self._cells[new_altitude] = cells
+
+
+class SearchState:
+    """The grid and path of a search, updated in place as the knight jumps and sleeps.
+
+    Every action pushes a small undo record (which cells a sleep changed, and
+    what they used to be), so backtracking just pops it instead of the search
+    having to copy the whole grid and path at every level.
     """
-    search_time = action[0]
-    for prev_state in reversed(path):
-        if prev_state == action:
+
+    def __init__(self, grid: Grid, path: list[KnightState], hashes: typing.Optional[tuple[int, int, int]] = None):
+        self.grid = grid.copy()
+        self.altitudes, self.unit = get_altitudes(self.grid)
+        self.path = list(path)
+        self.index = AltitudeIndex(self.altitudes)
+        # One entry per action in path (after the first): (cells, old altitudes)
+        # for a sleep (cells is None for a jump), how much the sleep refined an
+        # ExactGrid's denominator by, plus the hashes and islands from before
+        self._undo_log = []
+        # Islands are only built, and then brought up to date, when asked for
+        # (see islands), so keep the last map we made and which cells have moved since
+        self._islands = None
+        self._island_changes = frozenset()
+
+        # Bitmask of the cells visited at the current time, and Zobrist hashes.
+        # These can be passed in (see hashes) by whoever already has them for
+        # this grid and path, rather than hashing every cell again
+        self.hasher = get_hasher(self.altitudes.size)
+        if hashes is not None:
+            self.grid_key, self.visited, self.visited_key = hashes
+        else:
+            width = self.altitudes.shape[1]
+            self.grid_key = self.hasher.grid(self.altitudes.reshape(-1).tolist())
+            self.visited = 0
+            self.visited_key = 0
+            for t, (row, col) in self.path:
+                if t == self.time and not self.visited & (1 << row * width + col):
+                    self.visited |= 1 << row * width + col
+                    self.visited_key ^= self.hasher.visited_keys[row * width + col]
+
+    @property
+    def time(self) -> Time:
+        return self.path[-1][0]
+
+    @property
+    def position(self) -> Position:
+        return self.path[-1][1]
+
+    @property
+    def key(self) -> int:
+        """Zobrist hash of (grid, position, time, cells visited at this time)."""
+        row, col = self.position
+        cell = row * self.altitudes.shape[1] + col
+        return self.grid_key ^ self.hasher.position_keys[cell] ^ self.hasher.time(self.time) ^ self.visited_key
+
+    @property
+    def hashes(self) -> tuple[int, int, int]:
+        """Everything key is made from, besides the path: (grid key, visited, visited key)."""
+        return self.grid_key, self.visited, self.visited_key
+
+    @property
+    def islands(self) -> IslandMap:
+        if self._islands is None:
+            self._islands = IslandMap.build(self.altitudes.reshape(-1).tolist(), self.unit, get_neighbour_lists(self.altitudes.shape), exact=isinstance(self.grid, ExactGrid))
+            self._island_changes = frozenset()
+        elif self._island_changes:
+            self._islands = self._islands.updated(self.altitudes.reshape(-1).tolist(), self._island_changes)
+            self._island_changes = frozenset()
+        return self._islands
+
+    def jump(self, position: Position):
+        row, col = position
+        cell = row * self.altitudes.shape[1] + col
+        self._undo_log.append((None, None, 1, self.grid_key, self.visited, self.visited_key, self._islands, self._island_changes))
+        self.path.append((self.time, position))
+        if not self.visited & (1 << cell):
+            self.visited |= 1 << cell
+            self.visited_key ^= self.hasher.visited_keys[cell]
+
+    def sleep(self):
+        row, col = self.position
+        flat_altitudes = self.altitudes.reshape(-1)
+        cell = row * self.altitudes.shape[1] + col
+        # Diametrically opposite cell is the mirror image in the flattened grid too
+        opposite = flat_altitudes.size - 1 - cell
+        opposite_was_same_alt = flat_altitudes.item(opposite) == flat_altitudes.item(cell)
+        n = len(self.index.cells_at(flat_altitudes.item(cell))) - opposite_was_same_alt
+
+        # Everything from before has to be saved before we refine the grid
+        undo = (self.grid_key, self.visited, self.visited_key, self._islands, self._island_changes)
+        factor = 1
+        if isinstance(self.grid, ExactGrid):
+            factor = self.grid.refine(n)
+            if factor > 1:
+                self._refined()
+            rate = self.unit // n
+        else:
+            rate = self.unit / n
+
+        altitude = flat_altitudes.item(cell)
+        opposite_altitude = flat_altitudes.item(opposite)
+        sinking = self.index.cells_at(altitude)
+
+        if opposite_was_same_alt:
+            sinking = [other for other in sinking if other != opposite]
+            self.index.move(sinking, altitude, altitude - rate)
+            cells = np.array(sinking)
+        else:
+            cells = np.fromiter(sinking, dtype=np.intp, count=n)
+            self.index.move_all(altitude, altitude - rate)
+            self.index.move((opposite,), opposite_altitude, opposite_altitude + rate)
+            cells = np.append(cells, opposite)
+
+        self._undo_log.append((cells, flat_altitudes[cells], factor) + undo)
+        for other in cells[:n].tolist():
+            self.grid_key ^= self.hasher.altitude(other, altitude) ^ self.hasher.altitude(other, altitude - rate)
+        flat_altitudes[cells[:n]] -= rate
+        if not opposite_was_same_alt:
+            self.grid_key ^= self.hasher.altitude(opposite, opposite_altitude) ^ self.hasher.altitude(opposite, opposite_altitude + rate)
+            flat_altitudes[opposite] += rate
+        self._island_changes = self._island_changes.union(cells.tolist())
+        self.path.append((self.time + 1, (row, col)))
+        # New time, so the only cell visited at this time is where we are
+        self.visited = 1 << cell
+        self.visited_key = self.hasher.visited_keys[cell]
+
+    def _refined(self):
+        """Catch up with the grid's denominator having just gone up."""
+        self.unit = self.grid.denominator
+        self.index = AltitudeIndex(self.altitudes)
+        self.grid_key = self.hasher.grid(self.altitudes.reshape(-1).tolist())
+        self._islands = None
+        self._island_changes = frozenset()
+
+    def apply(self, action: KnightState):
+        action_time, position = action
+        if action_time > self.time:
+            self.sleep()
+        else:
+            self.jump(position)
+
+    def undo(self):
+        self.path.pop()
+        cells, old_altitudes, factor, self.grid_key, self.visited, self.visited_key, islands, island_changes = self._undo_log.pop()
+        if islands is not None or self._islands is None or factor > 1:
+            self._islands, self._island_changes = islands, island_changes
+        elif cells is not None:
+            # The islands were first built after this action, so keep them rather
+            # than build them again, and just note the cells that are going back
+            self._island_changes = self._island_changes.union(cells.tolist())
+        if cells is None:
+            return
+
+        flat_altitudes = self.altitudes.reshape(-1)
+        if factor > 1:
+            # Back to every altitude being a multiple of factor, so go back to
+            # the denominator from before this sleep
+            flat_altitudes[cells] = old_altitudes
+            self.grid.coarsen(factor)
+            self.unit = self.grid.denominator
+            self.index = AltitudeIndex(self.altitudes)
+            return
+
+        for cell, altitude, old_altitude in zip(cells.tolist(), flat_altitudes[cells].tolist(), old_altitudes.tolist()):
+            self.index.move((cell,), altitude, old_altitude)
+        flat_altitudes[cells] = old_altitudes
+
+    def valid_actions(self) -> list[KnightState]:
+        """Return the unvisited jumps from here, or else sleeping.
+
+        This doesn't try to work out whether sleeping is hopeless. That is
+        left to the pruners (see SinkTogetherPruner), so with every pruner
+        turned off a search needs a max_time to finish.
+        """
+        time, (row, col) = self.path[-1]
+        width = self.altitudes.shape[1]
+        jumps = find_jumps(self.altitudes, row * width + col, self.unit)
+        valid_actions = [(time, divmod(target, width)) for target in jumps if not self.visited & (1 << target)]
+        if len(valid_actions) == 0:
+            valid_actions.append((time + 1, (row, col)))
+        return valid_actions
+
+
+def island_shortcut(state: SearchState, target_time: int, target_pos: Position) -> typing.Optional[list]:
+    """Return the positions to jump through to reach the target without sleeping,
+    if it's late enough to win there and it's on the knight's island (and
+    reachable without going back over cells already visited at this time)."""
+    if state.time < target_time:
+        return None
+
+    width = state.altitudes.shape[1]
+    row, col = state.position
+    target = target_pos[0] * width + target_pos[1]
+    # Cheap check first, so we only bring the islands up to date when the
+    # target has any jumps in at all
+    jumps_in = find_jumps(state.altitudes, target, state.unit)
+    if not jumps_in:
+        return None
+    route = state.islands.route(row * width + col, target, blocked=state.visited)
+    if route is None:
+        return None
+    return [divmod(cell, width) for cell in route]
+
+
+class Pruner(ABC):
+    """A rule for spotting states that can never lead to a win.
+
+    Every pruner can be turned on and off on its own, and counts how many
+    states it looked at and how many it cut, so we can see what each rule is
+    worth (and check that turning it off never finds a win it would have cut).
+    """
+
+    name = "pruner"
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.checked = 0
+        self.pruned = 0
+
+    def check(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> bool:
+        """Return True (and count it) if the state should be pruned."""
+        self.checked += 1
+        if self.can_prune(state=state, actions=actions, target_time=target_time, target_pos=target_pos):
+            self.pruned += 1
             return True
-        
-        prev_time = prev_state[0]
-        if prev_time < search_time:
+        return False
+
+    @abstractmethod
+    def can_prune(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> bool:
+        """Return True if the state can never lead to a win."""
+
+    def __str__(self) -> str:
+        status = "on" if self.enabled else "off"
+        return f"{self.name} ({status}): pruned {self.pruned} of {self.checked} states"
+
+
+def only_sleeping(state: SearchState, actions: list[KnightState], target_pos: Position) -> bool:
+    """Return True if all the knight can do is sleep where it is, and it isn't
+    already sat on the target (where sleeping until target_time would win)."""
+    return len(actions) == 1 and actions[0][0] > state.time and state.position != target_pos
+
+
+class SinkTogetherPruner(Pruner):
+    """Cut states where the knight can only sleep, and sleeping can never
+    make a jump valid again.
+
+    While the knight keeps sleeping on one cell, that cell only ever sinks.
+    Cells at its altitude sink with it and never separate from it (except
+    the diametrically opposite cell, which stays put), other cells either
+    stay put or (the opposite cell) rise. So a neighbour is only ever worth
+    waiting for if it's below the altitude we'd need to sink to, and isn't
+    sinking along with us. The one exception is a neighbour at our altitude
+    that needs no change in altitude: we've just come from there, but can
+    jump back to it after a sleep.
+    """
+
+    name = "sink together"
+
+    def can_prune(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> bool:
+        if not only_sleeping(state, actions, target_pos):
             return False
 
-    # Don't think this should ever reach here, but if it does answer is definitely False!
-    return False
+        row, col = state.position
+        cell = row * state.altitudes.shape[1] + col
+        table = get_neighbour_table(state.altitudes.shape)
+        targets = table.cell_targets[cell]
+        flat_altitudes = state.altitudes.reshape(-1)
+        altitude = flat_altitudes[cell]
+        target_altitudes = flat_altitudes[targets]
+        alt_diffs = table.cell_alt_diffs[cell]
+        is_opposite = targets == table.opposites[cell]
 
-def get_valid_actions(grid: Grid, path: list[KnightState]) -> list[KnightState]:
-    """Return list of valid (t, P) states following from the current knight state."""
-    time, (row, col) = path[-1]
-    altitude = grid[row, col]
-    height, width = grid.shape
+        jump_back = (target_altitudes == altitude) & (alt_diffs == 0) & ~is_opposite
+        sink_to = (target_altitudes < altitude + alt_diffs * state.unit) & ((target_altitudes != altitude) | is_opposite)
+        return not (jump_back.any() or sink_to.any())
 
-    valid_actions = []
-    valid_combos = [(0, 1, 2), (0, 1, -2), (0, -1, 2), (0, -1, -2)]
-    any_valid_sleeps = False
-    for combo in valid_combos:
-        for perm in itertools.permutations(combo):
-            row_diff, col_diff, alt_diff = perm
-            new_row = row + row_diff
-            new_col = col + col_diff
-            new_alt = altitude + alt_diff
-            if new_row < 0 or new_row >= height or new_col < 0 or new_col >= width:
-                continue
-            if grid[new_row, new_col] == new_alt:
-                # Double-check that this state is not already in our path, 
-                # otherwise get infinte loop!
-                new_action = (time, (new_row, new_col))
-                if not search_for_action(action=new_action, path=path):
-                    valid_actions.append((time, (new_row, new_col)))
+
+class ExactSleepPruner(Pruner):
+    """Cut states where the knight can only sleep, by working out exactly
+    whether the sleeps ever end in a jump (exact grids only).
+
+    The sleeps happen in stretches where the same n cells sink by 1/n each
+    time, and the opposite cell either rises by 1/n or stays put. A stretch
+    only ends when we sink exactly onto the altitude of another cell (which
+    then sinks with us) or meet the rising opposite cell. Both of those, and
+    every jump, only happen if the gap is a whole number of steps, e.g. a
+    rising and a sinking cell only meet if they're an even number of steps
+    apart. So we can jump from one stretch to the next instead of sleeping
+    one step at a time, and give up once nothing is left to happen.
+    """
+
+    name = "exact sleep"
+
+    def can_prune(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> bool:
+        if not isinstance(state.grid, ExactGrid) or not only_sleeping(state, actions, target_pos):
+            return False
+
+        row, col = state.position
+        cell = row * state.altitudes.shape[1] + col
+        return not self.sleeping_ends_in_jump(state, cell)
+
+    @staticmethod
+    def sleeping_ends_in_jump(state: SearchState, cell: int) -> bool:
+        unit = state.unit
+        flat_altitudes = state.altitudes.reshape(-1).tolist()
+        opposite = len(flat_altitudes) - 1 - cell
+        altitude = flat_altitudes[cell]
+        opposite_altitude = flat_altitudes[opposite]
+
+        table = get_neighbour_table(state.altitudes.shape)
+        neighbours = list(zip(table.cell_targets[cell].tolist(), table.cell_alt_diffs[cell].tolist()))
+        sinking = state.index.cells_at(altitude) - {opposite}
+        # Cells that stay put (until we sink onto them), by altitude
+        still = {}
+        for other, other_altitude in enumerate(flat_altitudes):
+            if other != opposite and other not in sinking:
+                still.setdefault(other_altitude, []).append(other)
+
+        while True:
+            n = len(sinking)
+            if unit % n:
+                # Same as ExactGrid.refine, but these are Python ints, so there's
+                # no need to save or undo anything
+                factor = n // math.gcd(unit, n)
+                unit *= factor
+                altitude *= factor
+                opposite_altitude *= factor
+                flat_altitudes = [other_altitude * factor for other_altitude in flat_altitudes]
+                still = {other_altitude * factor: others for other_altitude, others in still.items()}
+            rate = unit // n
+            opposite_rising = opposite_altitude != altitude
+
+            # How many more sleeps until each neighbour is one jump away
+            first_jump = None
+            for target, alt_diff in neighbours:
+                gap = altitude + alt_diff * unit
+                if target in sinking:
+                    steps = 1 if alt_diff == 0 else None
+                elif target == opposite:
+                    gap -= opposite_altitude
+                    step = 2 * rate if opposite_rising else rate
+                    steps = gap // step if gap > 0 and gap % step == 0 else None
                 else:
-                    # print(f"Action {new_action} was already in path!")
-                    pass
-            elif grid[new_row, new_col] < new_alt:
-                # If target position has same altitude as current position, then 
-                # sleeping will *not* allow a valid jump in the future.
-                # The exception to this is if the target position also happens
-                # to be the diametrically opposite position, in which case the
-                # current position can sink below the target and *maybe* allow
-                # a valid jump in the future
-                is_opposite = (new_row, new_col) == get_opposite_position(grid, (row, col))
-                matching_altitude = grid[new_row, new_col] == altitude
-                if not matching_altitude or is_opposite:
-                    # print(f"Valid sleep from ({new_row}, {new_col}); {new_alt}")
-                    any_valid_sleeps = True
-                
-    # Only include sleep as a valid action if *no* valid jumps are available
-    if len(valid_actions) == 0 and any_valid_sleeps:
-        valid_actions.append((time+1, (row, col)))
-
-    return valid_actions
-
-
-def check_if_reachable(grid: Grid, target_pos: Position) -> bool:
-    """Return True if target position seems reachable now or in the future."""
-    row, col = target_pos
-    altitude = grid[row, col]
-    height, width = grid.shape
-    
-    valid_combos = [(0, 1, 2), (0, 1, -2), (0, -1, 2), (0, -1, -2)]
-    for combo in valid_combos:
-        for perm in itertools.permutations(combo):
-            row_diff, col_diff, alt_diff = perm
-            new_row = row + row_diff
-            new_col = col + col_diff
-            if new_row < 0 or new_row >= height or new_col < 0 or new_col >= width:
-                continue
-            
-            new_alt = altitude + alt_diff
-            actual_diff = altitude - grid[new_row, new_col]
-            if actual_diff < leniency_factor * alt_diff:
+                    gap -= flat_altitudes[target]
+                    steps = gap // rate if gap > 0 and gap % rate == 0 else None
+                if steps is not None and (first_jump is None or steps < first_jump):
+                    first_jump = steps
+
+            # How many more sleeps until this stretch ends
+            ends = [(altitude - other_altitude) // rate for other_altitude in still
+                    if other_altitude < altitude and (altitude - other_altitude) % rate == 0]
+            if not opposite_rising:
+                # It only stays put for one sleep, then it's below us
+                ends.append(1)
+            elif opposite_altitude < altitude and (altitude - opposite_altitude) % (2 * rate) == 0:
+                ends.append((altitude - opposite_altitude) // (2 * rate))
+
+            if first_jump is not None and (not ends or first_jump <= min(ends)):
                 return True
-            
-    return False
+            if not ends:
+                return False
 
+            steps = min(ends)
+            altitude -= steps * rate
+            if opposite_rising:
+                opposite_altitude += steps * rate
+            for other in still.pop(altitude, ()):
+                sinking.add(other)
 
-def search(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position) -> bool:
-    global search_count, roadblock_count
-    search_count += 1
-    if search_count % 1000 == 0:
-        print(f"Searched {search_count} paths. Found {roadblock_count} roadblocks")
-    if search_count % 1e5 == 0:
-        print(grid)
-        print(f"Path length = {len(path)}")
-        print(path)
+
+class LeniencyPruner(Pruner):
+    """The old check_if_reachable guess. It's not sound (it can cut winning
+    states), so it's off unless asked for."""
+
+    name = "leniency"
+
+    def __init__(self, enabled: bool = False, leniency: typing.Optional[float] = None):
+        super().__init__(enabled=enabled)
+        self.leniency = leniency
+
+    def can_prune(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> bool:
+        return not check_if_reachable(grid=state.grid, target_pos=target_pos, leniency=self.leniency)
+
+
+class Pruners:
+    """The pruners a search runs on every state it expands, cheapest first."""
+
+    def __init__(self, pruners: list[Pruner]):
+        self.pruners = pruners
+
+    def check(self, state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position) -> typing.Optional[Pruner]:
+        """Return the first enabled pruner that cuts the state, or None."""
+        for pruner in self.pruners:
+            if pruner.enabled and pruner.check(state=state, actions=actions, target_time=target_time, target_pos=target_pos):
+                return pruner
+        return None
+
+    def __getitem__(self, name: str) -> Pruner:
+        for pruner in self.pruners:
+            if pruner.name == name:
+                return pruner
+        raise KeyError(name)
+
+    def fresh_copy(self) -> "Pruners":
+        """Return a copy with the same settings but all counts at zero."""
+        pruners = copy.deepcopy(self)
+        for pruner in pruners.pruners:
+            pruner.checked = 0
+            pruner.pruned = 0
+        return pruners
+
+    def merge(self, other: "Pruners"):
+        """Add the counts from a copy of these pruners (e.g. one a worker process used)."""
+        for pruner, other_pruner in zip(self.pruners, other.pruners):
+            pruner.checked += other_pruner.checked
+            pruner.pruned += other_pruner.pruned
+
+    def __str__(self) -> str:
+        return "\n".join(str(pruner) for pruner in self.pruners)
+
+
+def find_dead_end(state: SearchState, actions: list[KnightState], target_time: int, target_pos: Position, pruners: Pruners) -> typing.Optional[str]:
+    """Return why the state is a dead end ("roadblock" if there's nothing to do,
+    otherwise the name of the pruner that cut it), or None if it isn't one."""
+    if len(actions) == 0:
+        return "roadblock"
+    pruner = pruners.check(state=state, actions=actions, target_time=target_time, target_pos=target_pos)
+    return None if pruner is None else pruner.name
+
+
+def default_pruners() -> Pruners:
+    return Pruners([SinkTogetherPruner(), ExactSleepPruner(), LeniencyPruner(enabled=False)])
+
+
+def search(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, table: typing.Optional[TranspositionTable] = None, pruners: typing.Optional[Pruners] = None, use_islands: bool = True, telemetry: typing.Optional["Telemetry"] = None) -> bool:
+    state = SearchState(grid=grid, path=path)
+    if pruners is None:
+        pruners = default_pruners()
+    return search_state(state=state, target_time=target_time, target_pos=target_pos, table=table, pruners=pruners, use_islands=use_islands, telemetry=telemetry)
+
+
+def search_state(state: SearchState, target_time: int, target_pos: Position, table: typing.Optional[TranspositionTable] = None, pruners: typing.Optional[Pruners] = None, use_islands: bool = True, telemetry: typing.Optional["Telemetry"] = None) -> bool:
+    """Depth-first search from the given state. If we win, state is left holding the winning path.
+
+    If a transposition table is given, states it already knows are dead ends
+    are skipped, and every new dead end found is added to it. States are cut
+    by the given pruners (or default_pruners()). If use_islands is True, we
+    jump straight to the target as soon as it's on the knight's island (see
+    island_shortcut). Progress goes to telemetry, if given.
+    """
+    if pruners is None:
+        pruners = default_pruners()
+    path = state.path
+    if telemetry is not None:
+        telemetry.node(depth=len(path))
 
     t, position = path[-1]
     if position == target_pos and t >= target_time:
         print("!!!!!!!!!!!!!!!!!!!! YOU WON !!!!!!!!!!!!!!!!!!!!")
         print(path)
         return True
-    
-    if not check_if_reachable(grid=grid, target_pos=target_pos):
-        print("Can't seem to reach target position!")
-        print(path)
-        print(grid)
-        roadblock_count += 1
+
+    if table is not None and table.is_dead(state.key):
+        if telemetry is not None:
+            telemetry.prune("transposition")
         return False
 
-    valid_actions = get_valid_actions(grid=grid, path=path)
-    if len(valid_actions) == 0:
-        # print("Reached roadblock!")
-        roadblock_count += 1
+    if use_islands:
+        route = island_shortcut(state=state, target_time=target_time, target_pos=target_pos)
+        if route is not None:
+            for island_position in route:
+                state.jump(island_position)
+            print("!!!!!!!!!!!!!!!!!!!! YOU WON !!!!!!!!!!!!!!!!!!!!")
+            print(path)
+            return True
+
+    valid_actions = state.valid_actions()
+    reason = find_dead_end(state=state, actions=valid_actions, target_time=target_time, target_pos=target_pos, pruners=pruners)
+    if reason is not None:
+        if telemetry is not None:
+            telemetry.prune(reason)
+        if table is not None:
+            table.mark_dead(state.key)
         return False
-    
-    for action in valid_actions:
-        action_time = action[0]
-        # print(f"{action_time=}")
-        if action_time > t:
-            new_grid = update_grid(grid=grid, position=position)
-            search_result = search(grid=new_grid, path=path + [action], target_time=target_time, target_pos=target_pos)
-        else:
-            search_result = search(grid=grid, path=path + [action], target_time=target_time, target_pos=target_pos)
 
-        if search_result is True:
+    for action in valid_actions:
+        state.apply(action)
+        if search_state(state=state, target_time=target_time, target_pos=target_pos, table=table, pruners=pruners, use_islands=use_islands, telemetry=telemetry):
             return True
+        state.undo()
 
+    if table is not None:
+        table.mark_dead(state.key)
     return False
 
 
 
+class IterativeSearch:
+    """Depth-first search that keeps its own stack of frames instead of recursing.
+
+    Each frame is just the actions available at that depth and the index of the
+    next one to try. The grid and path live in a single SearchState, and going
+    back up a frame is a single undo, so the search can go as deep as it likes.
+
+    The search can be paused by giving run() a node budget, and picks up where
+    it left off the next time run() is called. If max_time is given, states
+    after that time are not expanded (see iterative_deepening). If use_islands
+    is True, we jump straight to the target once it's on the knight's island.
+    Progress goes to telemetry, if given.
+    """
+
+    def __init__(self, grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, table: typing.Optional[TranspositionTable] = None, max_time: typing.Optional[int] = None, pruners: typing.Optional[Pruners] = None, use_islands: bool = True, telemetry: typing.Optional["Telemetry"] = None):
+        self.state = SearchState(grid=grid, path=path)
+        self.target_time = target_time
+        self.target_pos = target_pos
+        self.table = table
+        self.max_time = max_time
+        self.pruners = default_pruners() if pruners is None else pruners
+        self.use_islands = use_islands
+        self.telemetry = telemetry
+
+        self.status = "running"
+        self.nodes = 0
+        self.roadblocks = 0
+        # Whether max_time stopped us from expanding anything
+        self.time_limited = False
+        # Frames of [actions, index of next action, whether max_time cut off anything below]
+        self._stack = []
+        self._started = False
+
+    @property
+    def path(self) -> list[KnightState]:
+        return self.state.path
+
+    def run(self, node_budget: typing.Optional[int] = None) -> str:
+        """Keep searching until we win ("won"), run out of states ("exhausted"), or
+        have visited node_budget more nodes ("paused")."""
+        if self.status != "running" and self.status != "paused":
+            return self.status
+
+        self.status = "running"
+        last_node = None if node_budget is None else self.nodes + node_budget
+        if not self._started:
+            self._started = True
+            if self._visit():
+                return self.status
+
+        while self._stack:
+            if last_node is not None and self.nodes >= last_node:
+                self.status = "paused"
+                return self.status
+
+            frame = self._stack[-1]
+            actions, index, cut = frame
+            if index == len(actions):
+                # Everything below this state has been tried
+                self._stack.pop()
+                if cut:
+                    if self._stack:
+                        self._stack[-1][2] = True
+                elif self.table is not None:
+                    self.table.mark_dead(self.state.key)
+                if self._stack:
+                    self.state.undo()
+                continue
+
+            frame[1] += 1
+            self.state.apply(actions[index])
+            if self._visit():
+                return self.status
+
+        self.status = "exhausted"
+        return self.status
+
+    def _visit(self) -> bool:
+        """Check the state we just moved to, and push a frame for it if it's
+        worth expanding (otherwise step straight back out of it). Return True if
+        we've won."""
+        self.nodes += 1
+        state = self.state
+        telemetry = self.telemetry
+        if telemetry is not None:
+            telemetry.node(depth=len(state.path))
+        if state.position == self.target_pos and state.time >= self.target_time:
+            self.status = "won"
+            return True
+
+        if self.table is not None and self.table.is_dead(state.key):
+            if telemetry is not None:
+                telemetry.prune("transposition")
+            self._leave()
+            return False
+
+        if self.max_time is not None and state.time > self.max_time:
+            # Not necessarily a dead end, so don't tell the table about it
+            if telemetry is not None:
+                telemetry.prune("time limit")
+            self.time_limited = True
+            if self._stack:
+                self._stack[-1][2] = True
+            self._leave()
+            return False
+
+        if self.use_islands:
+            route = island_shortcut(state=state, target_time=self.target_time, target_pos=self.target_pos)
+            if route is not None:
+                for position in route:
+                    state.jump(position)
+                self.status = "won"
+                return True
+
+        actions = state.valid_actions()
+        reason = find_dead_end(state=state, actions=actions, target_time=self.target_time, target_pos=self.target_pos, pruners=self.pruners)
+        if reason is not None:
+            if telemetry is not None:
+                telemetry.prune(reason)
+            self._dead_end()
+            return False
+
+        self._stack.append([actions, 0, False])
+        return False
+
+    def _dead_end(self):
+        self.roadblocks += 1
+        if self.table is not None:
+            self.table.mark_dead(self.state.key)
+        self._leave()
+
+    def _leave(self):
+        # The starting state has no frame below it to go back to
+        if self._stack:
+            self.state.undo()
+
+
+def iterative_deepening(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, time_step: int = 1, node_budget: typing.Optional[int] = None, table: typing.Optional[TranspositionTable] = None, pruners: typing.Optional[Pruners] = None, use_islands: bool = True, telemetry: typing.Optional["Telemetry"] = None) -> IterativeSearch:
+    """Search with a time limit that starts at target_time and goes up by
+    time_step whenever the limit stopped the search from finishing.
+
+    Returns the last IterativeSearch, whose status says whether we won (and
+    its path how), ran out of states, or ran out of node_budget ("paused").
+    The same pruners are used for every time limit, so their counts add up.
+    """
+    if pruners is None:
+        pruners = default_pruners()
+    max_time = target_time
+    nodes = 0
+    while True:
+        search = IterativeSearch(grid=grid, path=path, target_time=target_time, target_pos=target_pos, table=table, max_time=max_time, pruners=pruners, use_islands=use_islands, telemetry=telemetry)
+        search.run(node_budget=None if node_budget is None else node_budget - nodes)
+        nodes += search.nodes
+        if telemetry is not None:
+            telemetry.report("time limit finished", max_time=max_time, status=search.status)
+        if search.status != "exhausted" or not search.time_limited:
+            return search
+        max_time += time_step
+
+
+def sleeps_to_target(altitudes: np.ndarray, unit, position: Position, target_pos: Position) -> int:
+    """Return a lower bound on how many sleeps it takes before the knight can be on target_pos.
+
+    The knight has to jump onto the target from one of its neighbours, so at
+    least one neighbour has to close its altitude gap with the target first.
+    A sleep moves any cell by at most 1, so closes a gap by at most 2.
+    """
+    if position == target_pos:
+        return 0
+    width = altitudes.shape[1]
+    table = get_neighbour_table(altitudes.shape)
+    target = target_pos[0] * width + target_pos[1]
+    flat_altitudes = altitudes.reshape(-1)
+    wanted = flat_altitudes[target] + table.cell_alt_diffs[target] * unit
+    gap = np.abs(flat_altitudes[table.cell_targets[target]] - wanted).min()
+    return int(-(-gap // (2 * unit)))
+
+
+class BestFirstSearch:
+    """Search that always expands whichever state could win the soonest.
+
+    States are ordered by a lower bound on the time we could win at, i.e. the
+    time so far plus sleeps_to_target (but never before target_time). Ties go
+    to the state closest to jumping onto the target and then to the deepest
+    one, so each stretch of equal bounds is searched depth-first. The first win
+    found is therefore one of the earliest.
+
+    States come off the queue in no particular path order, so the queue holds
+    a copy of each state's grid and path instead of sharing one SearchState,
+    along with its key and hashes so that popping it never has to hash the
+    whole grid again (and states we'd skip anyway are never rebuilt at all).
+    Otherwise this works like IterativeSearch: same move generator, pruners,
+    transposition table, islands, max_time and node budgets, and path holds
+    the winning path once we've won.
+    """
+
+    def __init__(self, grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, table: typing.Optional[TranspositionTable] = None, max_time: typing.Optional[int] = None, pruners: typing.Optional[Pruners] = None, use_islands: bool = True, telemetry: typing.Optional["Telemetry"] = None):
+        self.target_time = target_time
+        self.target_pos = target_pos
+        self.table = table
+        self.max_time = max_time
+        self.pruners = default_pruners() if pruners is None else pruners
+        self.use_islands = use_islands
+        self.telemetry = telemetry
+
+        self.status = "running"
+        self.nodes = 0
+        self.roadblocks = 0
+        self.time_limited = False
+        self._path = list(path)
+        self._queue = []
+        # Keys of states already expanded (or on their way to be)
+        self._seen = set()
+        self._order = itertools.count()
+        self._push(SearchState(grid=grid, path=path))
+
+    @property
+    def path(self) -> list[KnightState]:
+        return self._path
+
+    def _push(self, state: SearchState):
+        key = state.key
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        sleeps = sleeps_to_target(state.altitudes, state.unit, state.position, self.target_pos)
+        bound = max(state.time + sleeps, self.target_time)
+        heapq.heappush(self._queue, (bound, sleeps, -len(state.path), next(self._order), key, state.hashes, state.grid.copy(), list(state.path)))
+
+    def run(self, node_budget: typing.Optional[int] = None) -> str:
+        """Keep searching until we win ("won"), run out of states ("exhausted"), or
+        have visited node_budget more nodes ("paused")."""
+        if self.status != "running" and self.status != "paused":
+            return self.status
+
+        self.status = "running"
+        telemetry = self.telemetry
+        last_node = None if node_budget is None else self.nodes + node_budget
+        while self._queue:
+            if last_node is not None and self.nodes >= last_node:
+                self.status = "paused"
+                return self.status
+
+            *_, key, hashes, grid, path = heapq.heappop(self._queue)
+            t, position = path[-1]
+            self.nodes += 1
+            if telemetry is not None:
+                telemetry.node(depth=len(path))
+            if position == self.target_pos and t >= self.target_time:
+                self._path = path
+                self.status = "won"
+                return self.status
+
+            if self.table is not None and self.table.is_dead(key):
+                if telemetry is not None:
+                    telemetry.prune("transposition")
+                continue
+
+            if self.max_time is not None and t > self.max_time:
+                if telemetry is not None:
+                    telemetry.prune("time limit")
+                self.time_limited = True
+                continue
+
+            state = SearchState(grid=grid, path=path, hashes=hashes)
+
+            if self.use_islands:
+                route = island_shortcut(state=state, target_time=self.target_time, target_pos=self.target_pos)
+                if route is not None:
+                    for position in route:
+                        state.jump(position)
+                    self._path = state.path
+                    self.status = "won"
+                    return self.status
+
+            actions = state.valid_actions()
+            reason = find_dead_end(state=state, actions=actions, target_time=self.target_time, target_pos=self.target_pos, pruners=self.pruners)
+            if reason is not None:
+                if telemetry is not None:
+                    telemetry.prune(reason)
+                self.roadblocks += 1
+                if self.table is not None:
+                    self.table.mark_dead(key)
+                continue
+
+            for action in actions:
+                state.apply(action)
+                self._push(state)
+                state.undo()
+
+        self.status = "exhausted"
+        return self.status
+
+
+class ParallelResult(typing.NamedTuple):
+    status: str
+    path: list[KnightState]
+    nodes: int
+    time_limited: bool
+    pruners: Pruners
+
+
+def split_roots(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, depth: int, max_time: typing.Optional[int], pruners: Pruners) -> tuple[list[tuple[Grid, list[KnightState]]], int, typing.Optional[list]]:
+    """Expand the first depth actions from path, depth-first.
+
+    Returns the (grid, path) of every state left to search below that depth
+    (in the order a depth-first search would get to them), how many nodes it
+    took, and the winning path if we happened to win on the way.
+    """
+    state = SearchState(grid=grid, path=path)
+    roots = []
+    nodes = 0
+
+    def expand(depth: int) -> typing.Optional[list]:
+        nonlocal nodes
+        nodes += 1
+        if state.position == target_pos and state.time >= target_time:
+            return list(state.path)
+        if max_time is not None and state.time > max_time:
+            return None
+        if depth == 0:
+            # Searched again by a worker, so don't count it twice
+            nodes -= 1
+            roots.append((state.grid.copy(), list(state.path)))
+            return None
+
+        actions = state.valid_actions()
+        if find_dead_end(state=state, actions=actions, target_time=target_time, target_pos=target_pos, pruners=pruners) is not None:
+            return None
+        for action in actions:
+            state.apply(action)
+            won = expand(depth - 1)
+            state.undo()
+            if won is not None:
+                return won
+        return None
+
+    # Before reading nodes, which expand adds to
+    won = expand(depth)
+    return roots, nodes, won
+
+
+def search_subtree(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, max_time: typing.Optional[int], pruners: Pruners, node_chunk: int, cancel, shared_dead) -> ParallelResult:
+    """Run an IterativeSearch node_chunk nodes at a time (in a worker process),
+    giving up if cancel gets set, and swapping dead ends through shared_dead
+    (if given) between chunks."""
+    table = TranspositionTable() if shared_dead is None else SharedTranspositionTable(shared_dead)
+    search = IterativeSearch(grid=grid, path=path, target_time=target_time, target_pos=target_pos, table=table, max_time=max_time, pruners=pruners)
+    while search.run(node_budget=node_chunk) == "paused":
+        if cancel.is_set():
+            search.status = "cancelled"
+            break
+        if shared_dead is not None:
+            table.sync()
+    return ParallelResult(search.status, list(search.path), search.nodes, search.time_limited, search.pruners)
+
+
+def parallel_search(grid: Grid, path: list[KnightState], target_time: int, target_pos: Position, split_depth: int = 3, max_workers: typing.Optional[int] = None, node_chunk: int = 10_000, max_time: typing.Optional[int] = None, share_dead: bool = False, pruners: typing.Optional[Pruners] = None) -> ParallelResult:
+    """Same as IterativeSearch, but split into every state split_depth actions
+    in, each searched by a pool of processes.
+
+    As soon as one worker wins, the rest are told to stop (they check every
+    node_chunk nodes). If share_dead is True, workers also pass each other the
+    dead ends they've found, which costs a trip to a manager process every
+    chunk.
+    """
+    if pruners is None:
+        pruners = default_pruners()
+    roots, nodes, won = split_roots(grid=grid, path=path, target_time=target_time, target_pos=target_pos, depth=split_depth, max_time=max_time, pruners=pruners)
+    if won is not None:
+        return ParallelResult("won", won, nodes, False, pruners)
+
+    status = "exhausted"
+    best_path = list(path)
+    time_limited = False
+    with Manager() as manager, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        cancel = manager.Event()
+        shared_dead = manager.list() if share_dead else None
+        futures = [
+            executor.submit(search_subtree, root_grid, root_path, target_time, target_pos, max_time, pruners.fresh_copy(), node_chunk, cancel, shared_dead)
+            for root_grid, root_path in roots
+        ]
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            result = future.result()
+            nodes += result.nodes
+            time_limited = time_limited or result.time_limited
+            pruners.merge(result.pruners)
+            if result.status == "won" and status != "won":
+                status = "won"
+                best_path = result.path
+                cancel.set()
+                for other in futures:
+                    other.cancel()
+
+    return ParallelResult(status, best_path, nodes, time_limited, pruners)
+
+
 def main():
-    grid = np.array([
+    grid = ExactGrid.from_altitudes([
         [11, 10, 11, 14],
         [8, 6, 9, 9],
         [10, 4, 3, 1],
         [5, 6, 5, 0]
-    ], dtype=np.float64)
+    ])
     # Target is top-right corner
     target_pos = (0, grid.shape[1] - 1)
     target_time = 10
     path = [(0, (3, 0))]
 
-    search(grid=grid, path=path, target_time=target_time, target_pos=target_pos)
+    from telemetry import Telemetry
+
+    telemetry = Telemetry("knight_moves5")
+    search = iterative_deepening(grid=grid, path=path, target_time=target_time, target_pos=target_pos, table=TranspositionTable(), telemetry=telemetry)
+    telemetry.report("done", status=search.status)
+    print(f"Search {search.status} after {search.nodes} nodes with a time limit of {search.max_time}")
+    if search.status == "won":
+        print(search.path)
+    print(search.pruners)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,509 @@
+from fractions import Fraction
+import itertools
+import random
+import unittest
+
+import numpy as np
+from knight_moves5 import (AltitudeIndex, BestFirstSearch, ExactGrid, IterativeSearch, Pruner, Pruners, SearchState, default_pruners, find_jumps,
+                           get_neighbour_lists, get_neighbour_table, iterative_deepening, parallel_search)
+from islands import IslandMap
+from transposition import SharedTranspositionTable, TranspositionTable
+
+# (change in row, change in col, change in altitude) for every knight move
+MOVES = [perm for combo in [(0, 1, 2), (0, 1, -2), (0, -1, 2), (0, -1, -2)] for perm in itertools.permutations(combo)]
+
+
+def random_board(rng: random.Random) -> list[list[int]]:
+    # Even sides, so no cell is its own diametrically opposite cell
+    height, width = rng.choice([(2, 2), (2, 4), (4, 2), (4, 4)])
+    return [[rng.randint(0, 3) for _ in range(width)] for _ in range(height)]
+
+
+def jumps(altitudes: list[list[Fraction]], position: tuple[int, int], visited: set) -> list[tuple[int, int]]:
+    height, width = len(altitudes), len(altitudes[0])
+    row, col = position
+    found = []
+    for row_diff, col_diff, alt_diff in MOVES:
+        new_row, new_col = row + row_diff, col + col_diff
+        if (0 <= new_row < height and 0 <= new_col < width and (new_row, new_col) not in visited
+                and altitudes[new_row][new_col] == altitudes[row][col] + alt_diff):
+            found.append((new_row, new_col))
+    return found
+
+
+def sleep(altitudes: list[list[Fraction]], position: tuple[int, int]) -> list[list[Fraction]]:
+    height, width = len(altitudes), len(altitudes[0])
+    row, col = position
+    opposite = (height - 1 - row, width - 1 - col)
+    altitude = altitudes[row][col]
+    sinking = [(r, c) for r in range(height) for c in range(width) if altitudes[r][c] == altitude and (r, c) != opposite]
+    rate = Fraction(1, len(sinking))
+    slept = [list(cells) for cells in altitudes]
+    for r, c in sinking:
+        slept[r][c] -= rate
+    if altitudes[opposite[0]][opposite[1]] != altitude:
+        slept[opposite[0]][opposite[1]] += rate
+    return slept
+
+
+def replay(board: list[list[int]], path: list) -> tuple[list[list[Fraction]], set]:
+    """Return the altitudes after following path from the board, and the cells visited at the last time."""
+    altitudes = [[Fraction(altitude) for altitude in row] for row in board]
+    time, position = path[0]
+    visited = {position}
+    for next_time, next_position in path[1:]:
+        if next_time > time:
+            altitudes = sleep(altitudes, position)
+            visited = {position}
+        else:
+            visited.add(next_position)
+        time, position = next_time, next_position
+    return altitudes, visited
+
+
+def brute_force(board: list[list[int]], start: tuple[int, int], target_time: int, target_pos: tuple[int, int], max_time: int) -> bool:
+    """Return True if the knight can win, trying every move with nothing cut
+    except states after max_time (the same limit the searches use)."""
+    def visit(altitudes, time, position, visited) -> bool:
+        if position == target_pos and time >= target_time:
+            return True
+        if time > max_time:
+            return False
+        found = jumps(altitudes, position, visited)
+        if found:
+            return any(visit(altitudes, time, jump, visited | {jump}) for jump in found)
+        return visit(sleep(altitudes, position), time + 1, position, {position})
+
+    altitudes = [[Fraction(altitude) for altitude in row] for row in board]
+    return visit(altitudes, 0, start, {start})
+
+
+def is_winning_path(board: list[list[int]], path: list, target_time: int, target_pos: tuple[int, int]) -> bool:
+    """Replay the path and check every step is a legal move, and that it ends in a win."""
+    altitudes = [[Fraction(altitude) for altitude in row] for row in board]
+    time, position = path[0]
+    visited = {position}
+    for next_time, next_position in path[1:]:
+        if next_time == time + 1 and next_position == position and not jumps(altitudes, position, visited):
+            altitudes = sleep(altitudes, position)
+            visited = {position}
+        elif next_time == time and next_position in jumps(altitudes, position, visited):
+            visited.add(next_position)
+        else:
+            return False
+        time, position = next_time, next_position
+    return position == target_pos and time >= target_time
+
+
+def random_problems(seed: int, trials: int):
+    """Yield (trial, board, start, target_time, target_pos, max_time, whether brute force can win)."""
+    rng = random.Random(seed)
+    for trial in range(trials):
+        board = random_board(rng)
+        height, width = len(board), len(board[0])
+        start = (height - 1, 0)
+        target_pos = (0, width - 1)
+        target_time = rng.randint(0, 2)
+        max_time = target_time + 3
+        yield trial, board, start, target_time, target_pos, max_time, brute_force(board, start, target_time, target_pos, max_time)
+
+
+def random_walks(seed: int, trials: int = 40, steps: int = 30, big: bool = False):
+    """Yield (trial, board, state) after each step of random apply/undo
+    sequences, on both exact and float grids."""
+    rng = random.Random(seed)
+    for trial in range(trials):
+        if big:
+            # Lots of cells at the same altitude, so sleeps need big denominators
+            board = [[rng.randint(0, 2) for _ in range(10)] for _ in range(10)]
+        else:
+            board = random_board(rng)
+        grid = ExactGrid.from_altitudes(board) if trial % 2 else np.array(board, dtype=float)
+        state = SearchState(grid, [(0, (len(board) - 1, 0))])
+        depth = 0
+        for _ in range(steps):
+            if depth and rng.random() < 0.4:
+                state.undo()
+                depth -= 1
+            else:
+                state.apply(rng.choice(state.valid_actions()))
+                depth += 1
+            yield trial, board, state
+
+
+class TestExactGrid(unittest.TestCase):
+    def test_from_altitudes(self):
+        grid = ExactGrid.from_altitudes([[1, 2], [3, -4]])
+        self.assertEqual(grid.denominator, 1)
+        self.assertEqual(grid[1, 1], Fraction(-4))
+        with self.assertRaises(ValueError):
+            ExactGrid.from_altitudes([[1, 2.5]])
+
+    def test_refine_and_coarsen(self):
+        grid = ExactGrid.from_altitudes([[1, 2], [3, 4]])
+        before = grid.to_fractions()
+        self.assertEqual(grid.refine(4), 4)
+        self.assertEqual(grid.refine(6), 3)
+        # Already a whole number of steps
+        self.assertEqual(grid.refine(3), 1)
+        self.assertEqual(grid.denominator, 12)
+        np.testing.assert_array_equal(grid.to_fractions(), before)
+
+        grid.numerators[0, 0] -= grid.denominator // 6
+        self.assertEqual(grid[0, 0], Fraction(5, 6))
+        grid.numerators[0, 0] += grid.denominator // 6
+        grid.coarsen(3)
+        self.assertEqual(grid.denominator, 4)
+        np.testing.assert_array_equal(grid.to_fractions(), before)
+
+    def test_big_boards(self):
+        # lcm(1, ..., 100) is far too big for int64, but only the n's used are needed
+        grid = ExactGrid.from_altitudes(np.arange(100).reshape(10, 10))
+        for n in (97, 89, 97, 2):
+            grid.refine(n)
+        self.assertEqual(grid.denominator, 97 * 89 * 2)
+        self.assertEqual(grid[9, 9], 99)
+
+        with self.assertRaises(OverflowError):
+            for n in range(2, 100):
+                grid.refine(n)
+        # Nothing changed by the refine that would have overflowed
+        self.assertEqual(grid[9, 9], 99)
+
+
+class TestNeighbours(unittest.TestCase):
+    def test_neighbour_table(self):
+        for height, width in [(1, 1), (2, 4), (3, 5), (8, 8)]:
+            with self.subTest(shape=(height, width)):
+                table = get_neighbour_table((height, width))
+                lists = get_neighbour_lists((height, width))
+                for row, col in itertools.product(range(height), range(width)):
+                    cell = row * width + col
+                    expected = [((row + row_diff) * width + col + col_diff, alt_diff) for row_diff, col_diff, alt_diff in MOVES
+                                if 0 <= row + row_diff < height and 0 <= col + col_diff < width]
+                    self.assertEqual(list(zip(table.cell_targets[cell].tolist(), table.cell_alt_diffs[cell].tolist())), expected)
+                    self.assertEqual(lists[cell], expected)
+                    self.assertEqual(table.opposites[cell], (height - 1 - row) * width + width - 1 - col)
+
+    def test_find_jumps(self):
+        rng = random.Random(10)
+        for trial in range(50):
+            board = random_board(rng)
+            width = len(board[0])
+            grid = ExactGrid.from_altitudes(board)
+            # Same jumps whatever the denominator
+            grid.refine(rng.randint(1, 4))
+            altitudes = [[Fraction(altitude) for altitude in row] for row in board]
+            for row, col in itertools.product(range(len(board)), range(width)):
+                with self.subTest(trial=trial, board=board, cell=(row, col)):
+                    expected = [r * width + c for r, c in jumps(altitudes, (row, col), set())]
+                    self.assertEqual(find_jumps(grid.numerators, row * width + col, grid.denominator), expected)
+                    self.assertEqual(find_jumps(np.array(board, dtype=float), row * width + col, 1), expected)
+
+
+class TestSearchState(unittest.TestCase):
+    def assert_matches_replay(self, board, state):
+        altitudes, visited = replay(board, state.path)
+        if not isinstance(state.grid, ExactGrid):
+            # Rounding can make a float grid go its own way after a few sleeps
+            # (which is what ExactGrid is for), so only the first one is checked
+            if state.time > 1:
+                return
+            np.testing.assert_allclose(state.grid, np.array(altitudes, dtype=float))
+        else:
+            self.assertEqual(state.grid.to_fractions().tolist(), altitudes)
+        expected = [(state.time, jump) for jump in jumps(altitudes, state.position, visited)] or [(state.time + 1, state.position)]
+        self.assertCountEqual(state.valid_actions(), expected)
+
+    def test_random_walks(self):
+        for trial, board, state in random_walks(seed=4):
+            with self.subTest(trial=trial, path=state.path):
+                self.assert_matches_replay(board, state)
+                # Same key as working it out from scratch
+                self.assertEqual(state.key, SearchState(state.grid, state.path).key)
+
+    def test_big_boards(self):
+        for trial, board, state in random_walks(seed=5, trials=4, steps=400, big=True):
+            with self.subTest(trial=trial, path=state.path):
+                self.assert_matches_replay(board, state)
+
+    def test_undo(self):
+        rng = random.Random(6)
+        for trial in range(20):
+            board = random_board(rng)
+            grid = ExactGrid.from_altitudes(board) if trial % 2 else np.array(board, dtype=float)
+            state = SearchState(grid, [(0, (len(board) - 1, 0))])
+            before = []
+            for _ in range(20):
+                before.append((state.grid.copy(), list(state.path), state.key))
+                state.apply(rng.choice(state.valid_actions()))
+            while before:
+                grid, path, key = before.pop()
+                state.undo()
+                with self.subTest(trial=trial, path=path):
+                    self.assertEqual(state.path, path)
+                    self.assertEqual(state.key, key)
+                    if isinstance(grid, ExactGrid):
+                        self.assertEqual(state.grid.denominator, grid.denominator)
+                        np.testing.assert_array_equal(state.grid.numerators, grid.numerators)
+                    else:
+                        np.testing.assert_array_equal(state.grid, grid)
+
+
+class TestAltitudeIndex(unittest.TestCase):
+    def test_moves(self):
+        index = AltitudeIndex(np.array([[1, 2], [1, 1]]))
+        self.assertEqual(index.cells_at(1), {0, 2, 3})
+        self.assertEqual(index.cells_at(5), set())
+        index.move((2,), 1, 2)
+        self.assertEqual(index.cells_at(2), {1, 2})
+        index.move_all(1, 0)
+        self.assertEqual(index.cells_at(0), {0, 3})
+        self.assertEqual(index._cells.keys(), {0, 2})
+
+    def test_random_walks(self):
+        for trial, board, state in random_walks(seed=2):
+            with self.subTest(trial=trial, path=state.path):
+                fresh = AltitudeIndex(state.altitudes)
+                for altitude in set(state.altitudes.reshape(-1).tolist()):
+                    self.assertEqual(state.index.cells_at(altitude), fresh.cells_at(altitude))
+                # Nothing is left over at altitudes no cell has any more
+                self.assertEqual(state.index._cells.keys(), fresh._cells.keys())
+
+
+class TestIslands(unittest.TestCase):
+    def test_random_walks(self):
+        for trial, board, state in random_walks(seed=3):
+            with self.subTest(trial=trial, path=state.path):
+                altitudes = state.altitudes.reshape(-1).tolist()
+                fresh = IslandMap.build(altitudes, state.unit, get_neighbour_lists(state.altitudes.shape),
+                                        exact=isinstance(state.grid, ExactGrid))
+                islands = state.islands
+                for cell, other in itertools.combinations(range(len(altitudes)), 2):
+                    self.assertEqual(islands.same_island(cell, other), fresh.same_island(cell, other))
+
+    def test_route(self):
+        for trial, board, state in random_walks(seed=13):
+            if not isinstance(state.grid, ExactGrid):
+                continue
+            altitudes, visited = replay(board, state.path)
+            width = len(board[0])
+            row, col = state.position
+            start = row * width + col
+            for end in range(len(board) * width):
+                with self.subTest(trial=trial, path=state.path, end=end):
+                    islands = state.islands
+                    # Without anything blocked, there's a route to every cell on the island
+                    route = islands.route(start, end)
+                    self.assertEqual(route is not None, islands.same_island(start, end))
+
+                    route = islands.route(start, end, blocked=state.visited)
+                    if route is None:
+                        continue
+                    position, seen = state.position, set(visited)
+                    for cell in route:
+                        self.assertIn(divmod(cell, width), jumps(altitudes, position, seen))
+                        position = divmod(cell, width)
+                        seen.add(position)
+                    self.assertEqual(position, divmod(end, width))
+
+
+class TestTranspositionTable(unittest.TestCase):
+    def test_eviction(self):
+        table = TranspositionTable(max_entries=2)
+        table.mark_dead(1)
+        table.mark_dead(2)
+        # Using 1 makes 2 the least recently used
+        self.assertTrue(table.is_dead(1))
+        table.mark_dead(3)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.evictions, 1)
+        self.assertFalse(table.is_dead(2))
+        self.assertTrue(table.is_dead(3))
+        self.assertTrue(table.is_dead(1))
+        self.assertEqual((table.hits, table.misses), (3, 1))
+
+        # Marking a key again doesn't take up another entry
+        table.mark_dead(1)
+        self.assertEqual((len(table), table.evictions), (2, 1))
+
+    def test_keys(self):
+        # Each key should stand for exactly one (grid, position, time, cells visited at that time)
+        keys = {}
+        for trial, board, state in random_walks(seed=7, trials=80):
+            if not isinstance(state.grid, ExactGrid):
+                continue
+            _, visited = replay(board, state.path)
+            described = (str(state.grid.to_fractions().tolist()), state.position, state.time, frozenset(visited))
+            with self.subTest(trial=trial, path=state.path):
+                self.assertEqual(keys.setdefault(described, state.key), state.key)
+        self.assertEqual(len(set(keys.values())), len(keys))
+
+
+class TestIterativeSearch(unittest.TestCase):
+    def test_matches_brute_force(self):
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=0, trials=60):
+            searches = {
+                "pruned": lambda grid: IterativeSearch(grid, [(0, start)], target_time, target_pos, table=TranspositionTable(), max_time=max_time),
+                "unpruned": lambda grid: IterativeSearch(grid, [(0, start)], target_time, target_pos, max_time=max_time, pruners=Pruners([]), use_islands=False),
+            }
+            for name, make_search in searches.items():
+                with self.subTest(trial=trial, board=board, target_time=target_time, search=name):
+                    search = make_search(ExactGrid.from_altitudes(board))
+                    status = search.run()
+                    self.assertEqual(status == "won", expected)
+                    if expected:
+                        self.assertTrue(is_winning_path(board, search.path, target_time, target_pos))
+
+    def test_pause_and_resume(self):
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=8, trials=30):
+            with self.subTest(trial=trial, board=board, target_time=target_time):
+                whole = IterativeSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, table=TranspositionTable(), max_time=max_time)
+                status = whole.run()
+
+                bits = IterativeSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, table=TranspositionTable(), max_time=max_time)
+                runs = 0
+                while bits.run(node_budget=3) == "paused":
+                    runs += 1
+                self.assertEqual(bits.status, status)
+                self.assertEqual(bits.nodes, whole.nodes)
+                self.assertEqual(bits.path, whole.path)
+                self.assertGreaterEqual(runs, (whole.nodes - 1) // 3)
+                # Finished searches stay finished
+                self.assertEqual(bits.run(node_budget=3), status)
+                self.assertEqual(bits.nodes, whole.nodes)
+
+    def test_iterative_deepening(self):
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=9, trials=15):
+            with self.subTest(trial=trial, board=board, target_time=target_time):
+                search = iterative_deepening(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, node_budget=50_000, table=TranspositionTable())
+                if expected:
+                    self.assertEqual(search.status, "won")
+                if search.status == "won":
+                    self.assertTrue(is_winning_path(board, search.path, target_time, target_pos))
+                    self.assertLessEqual(search.path[-1][0], search.max_time)
+                elif search.status == "exhausted":
+                    self.assertFalse(search.time_limited)
+                else:
+                    # Some boards can be slept on forever without a win
+                    self.assertEqual(search.status, "paused")
+
+
+class TestBestFirstSearch(unittest.TestCase):
+    def test_matches_brute_force(self):
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=0, trials=60):
+            with self.subTest(trial=trial, board=board, target_time=target_time):
+                search = BestFirstSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, table=TranspositionTable(), max_time=max_time)
+                self.assertEqual(search.run() == "won", expected)
+                if expected:
+                    self.assertTrue(is_winning_path(board, search.path, target_time, target_pos))
+                    earliest = next(time for time in range(target_time, max_time + 1)
+                                    if brute_force(board, start, target_time, target_pos, time))
+                    self.assertEqual(search.path[-1][0], earliest)
+
+    def test_pause_and_resume(self):
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=11, trials=30):
+            with self.subTest(trial=trial, board=board, target_time=target_time):
+                whole = BestFirstSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, max_time=max_time)
+                whole.run()
+                bits = BestFirstSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, max_time=max_time)
+                while bits.run(node_budget=2) == "paused":
+                    pass
+                self.assertEqual((bits.status, bits.nodes, bits.path), (whole.status, whole.nodes, whole.path))
+
+
+class TestParallelSearch(unittest.TestCase):
+    def test_matches_iterative_search(self):
+        # Only a few boards, since each one starts its own processes
+        for trial, board, start, target_time, target_pos, max_time, expected in random_problems(seed=12, trials=6):
+            single = IterativeSearch(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, table=TranspositionTable(), max_time=max_time)
+            single.run()
+            for share_dead in (False, True):
+                with self.subTest(trial=trial, board=board, target_time=target_time, share_dead=share_dead):
+                    result = parallel_search(ExactGrid.from_altitudes(board), [(0, start)], target_time, target_pos, split_depth=2,
+                                             max_workers=2, node_chunk=5, max_time=max_time, share_dead=share_dead)
+                    self.assertEqual(result.status, single.status)
+                    self.assertEqual(result.status == "won", expected)
+                    if expected:
+                        self.assertTrue(is_winning_path(board, result.path, target_time, target_pos))
+                    else:
+                        self.assertEqual(result.time_limited, single.time_limited)
+                    self.assertGreater(result.nodes, 0)
+
+    def test_sync(self):
+        shared = []
+        first = SharedTranspositionTable(shared)
+        second = SharedTranspositionTable(shared, max_entries=2)
+        first.mark_dead(1)
+        first.mark_dead(2)
+        second.mark_dead(3)
+        # Nothing is passed on until sync
+        self.assertFalse(second.is_dead(1))
+        self.assertEqual(shared, [])
+
+        first.sync()
+        second.sync()
+        self.assertEqual(shared, [1, 2, 3])
+        self.assertTrue(second.is_dead(2))
+        # second only has room for 2, so 1 was pushed out by the rest
+        self.assertFalse(second.is_dead(1))
+        first.sync()
+        self.assertTrue(first.is_dead(3))
+        self.assertEqual(len(first), 3)
+
+        # Keys only go out once, and nothing comes back that's already known
+        first.sync()
+        second.sync()
+        self.assertEqual(shared, [1, 2, 3])
+        self.assertEqual(len(first), 3)
+
+
+class TestPruners(unittest.TestCase):
+    def test_pruners_never_cut_a_win(self):
+        rng = random.Random(1)
+        names = [pruner.name for pruner in default_pruners().pruners]
+        for trial in range(40):
+            board = random_board(rng)
+            height, width = len(board), len(board[0])
+            start = (height - 1, 0)
+            target_pos = (0, width - 1)
+            unpruned = IterativeSearch(ExactGrid.from_altitudes(board), [(0, start)], 1, target_pos, max_time=5, pruners=Pruners([])).run()
+            for name in names:
+                with self.subTest(trial=trial, board=board, pruner=name):
+                    # Each pruner on its own, even the ones that are off by default
+                    pruners = default_pruners()
+                    for pruner in pruners.pruners:
+                        pruner.enabled = pruner.name == name
+                    pruned = IterativeSearch(ExactGrid.from_altitudes(board), [(0, start)], 1, target_pos, max_time=5, pruners=pruners)
+                    self.assertEqual(pruned.run(), unpruned)
+                    self.assertLessEqual(pruners[name].pruned, pruners[name].checked)
+
+    def test_counts(self):
+        board = [[0, 1], [2, 0], [1, 1], [2, 1]]
+        pruners = default_pruners()
+        IterativeSearch(ExactGrid.from_altitudes(board), [(0, (3, 0))], 2, (0, 1), max_time=6, pruners=pruners).run()
+        self.assertTrue(any(pruner.checked for pruner in pruners.pruners))
+
+        fresh = pruners.fresh_copy()
+        self.assertEqual([(pruner.checked, pruner.pruned) for pruner in fresh.pruners], [(0, 0)] * len(fresh.pruners))
+        self.assertEqual([pruner.enabled for pruner in fresh.pruners], [pruner.enabled for pruner in pruners.pruners])
+        fresh.merge(pruners)
+        fresh.merge(pruners)
+        for pruner, merged in zip(pruners.pruners, fresh.pruners):
+            self.assertEqual((merged.checked, merged.pruned), (2 * pruner.checked, 2 * pruner.pruned))
+        with self.assertRaises(KeyError):
+            pruners["no such pruner"]
+
+    def test_pruner_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Pruner()
+
+        class NoRule(Pruner):
+            name = "no rule"
+
+        with self.assertRaises(TypeError):
+            NoRule()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+from collections import OrderedDict
+import random
+
+
+MASK_64 = (1 << 64) - 1
+
+
+def mix_64(x: int) -> int:
+    """Scramble a 64-bit integer (the splitmix64 finaliser)."""
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & MASK_64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & MASK_64
+    return x ^ (x >> 31)
+
+
+class ZobristHasher:
+    """Random 64-bit keys for every part of a knight's state.
+
+    The key of a state is the XOR of the keys of its parts: the altitude of every
+    cell, the knight's position, the time, and which cells the knight has
+    already visited at this time. Changing one part only needs two XORs, so the
+    key can be kept up to date as the search goes instead of being recomputed.
+
+    Altitudes can be any (exact) value, so rather than a table of keys per value
+    we mix the value into a random key per cell.
+    """
+
+    def __init__(self, num_cells: int, seed: int = 0):
+        rng = random.Random(seed)
+        self.altitude_keys = [rng.getrandbits(64) for _ in range(num_cells)]
+        self.position_keys = [rng.getrandbits(64) for _ in range(num_cells)]
+        self.visited_keys = [rng.getrandbits(64) for _ in range(num_cells)]
+        self.time_key = rng.getrandbits(64)
+
+    def altitude(self, cell: int, altitude) -> int:
+        return mix_64(self.altitude_keys[cell] ^ (hash(altitude) & MASK_64))
+
+    def time(self, t: int) -> int:
+        return mix_64(self.time_key ^ (t & MASK_64))
+
+    def grid(self, altitudes: list) -> int:
+        key = 0
+        for cell, altitude in enumerate(altitudes):
+            key ^= self.altitude(cell, altitude)
+        return key
+
+
+class TranspositionTable:
+    """Keys of states that are already known to be dead ends.
+
+    Holds at most max_entries keys (8 bytes of key plus dict overhead, so
+    roughly 100 bytes each). Once full, the least recently used key is evicted.
+    """
+
+    def __init__(self, max_entries: int = 1_000_000):
+        self.max_entries = max_entries
+        self._dead = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._dead)
+
+    def is_dead(self, key: int) -> bool:
+        if key in self._dead:
+            self._dead.move_to_end(key)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def mark_dead(self, key: int):
+        self._dead[key] = None
+        self._dead.move_to_end(key)
+        if len(self._dead) > self.max_entries:
+            self._dead.popitem(last=False)
+            self.evictions += 1
+
+
+class SharedTranspositionTable(TranspositionTable):
+    """A TranspositionTable that also swaps dead ends with other processes.
+
+    shared is a list that every process can append to, e.g. from a
+    multiprocessing.Manager. New dead ends are only sent and received when
+    sync() is called, since every access to shared is a round trip to the
+    manager process.
+    """
+
+    def __init__(self, shared, max_entries: int = 1_000_000):
+        super().__init__(max_entries=max_entries)
+        self.shared = shared
+        self._unsent = []
+        self._received = 0
+
+    def mark_dead(self, key: int):
+        super().mark_dead(key)
+        self._unsent.append(key)
+
+    def sync(self):
+        if self._unsent:
+            self.shared.extend(self._unsent)
+            self._unsent = []
+        new_keys = self.shared[self._received:]
+        self._received += len(new_keys)
+        for key in new_keys:
+            if key not in self._dead:
+                super().mark_dead(key)
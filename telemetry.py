@@ -0,0 +1,90 @@
+"""Counters and a periodic progress reporter shared by the puzzle solvers.
+
+Solvers take an optional Telemetry and only touch it behind an
+`if telemetry is not None` check, so passing None switches it off completely.
+Every report is one JSON object per line (with sorted keys), so two runs can
+be diffed line by line. The counts are deterministic, only the timing and
+memory fields change from run to run.
+
+This file is at the top of the repo, so the puzzles' scripts need the top of
+the repo on the path, e.g. `PYTHONPATH=.. python solver.py` from the puzzle's
+folder. The tests get it from pytest.ini.
+"""
+from collections import Counter
+from time import perf_counter
+import json
+import sys
+import typing
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, so we just can't report memory there
+    resource = None
+
+
+class Telemetry:
+    """Counts the nodes a search visits (and how deep they were), and the
+    states it pruned (by reason), plus any other named counters.
+
+    Checking the clock on every node would cost more than the nodes
+    themselves, so it's only checked every check_every nodes, and a
+    "progress" line is written once at least report_every seconds have passed
+    since the last one.
+    """
+
+    def __init__(self, name: str, stream: typing.Optional[typing.TextIO] = None, report_every: float = 5.0, check_every: int = 4096):
+        self.name = name
+        self.stream = sys.stderr if stream is None else stream
+        self.report_every = report_every
+        self.check_every = check_every
+
+        self.nodes = 0
+        self.depths = Counter()
+        self.prunes = Counter()
+        self.counters = Counter()
+
+        self._start = perf_counter()
+        self._last_report = self._start
+        self._last_report_nodes = 0
+        self._next_check = check_every
+
+    def node(self, depth: typing.Optional[int] = None, count: int = 1):
+        self.nodes += count
+        if depth is not None:
+            self.depths[depth] += count
+        if self.nodes >= self._next_check:
+            self._next_check = self.nodes + self.check_every
+            if perf_counter() - self._last_report >= self.report_every:
+                self.report("progress")
+
+    def prune(self, reason: str, count: int = 1):
+        self.prunes[reason] += count
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def snapshot(self) -> dict:
+        now = perf_counter()
+        interval = now - self._last_report
+        return {
+            "solver": self.name,
+            "nodes": self.nodes,
+            # [depth, count] pairs, since JSON keys would get sorted as strings
+            "depths": sorted(self.depths.items()),
+            "prunes": dict(self.prunes),
+            "counters": dict(self.counters),
+            "elapsed_seconds": round(now - self._start, 3),
+            "nodes_per_second": round((self.nodes - self._last_report_nodes) / interval, 1) if interval > 0 else None,
+            "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else None,
+        }
+
+    def report(self, event: str, **fields):
+        """Write one JSON line for this event, with the current counts and any extra fields."""
+        line = self.snapshot()
+        line["event"] = event
+        line.update(fields)
+        self.stream.write(json.dumps(line, sort_keys=True, default=str) + "\n")
+        self.stream.flush()
+        self._last_report = perf_counter()
+        self._last_report_nodes = self.nodes
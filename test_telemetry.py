@@ -0,0 +1,54 @@
+import io
+import json
+import unittest
+
+from telemetry import Telemetry
+
+
+class TestTelemetry(unittest.TestCase):
+    def test_report(self):
+        stream = io.StringIO()
+        telemetry = Telemetry("test", stream=stream)
+        telemetry.node(depth=2)
+        telemetry.node(depth=1, count=3)
+        telemetry.node()
+        telemetry.prune("dead end")
+        telemetry.prune("dead end", 2)
+        telemetry.count("sleeps", 5)
+        telemetry.report("done", max_time=7, status="won")
+
+        line = stream.getvalue()
+        self.assertTrue(line.endswith("\n"))
+        self.assertEqual(line.count("\n"), 1)
+        report = json.loads(line)
+        self.assertEqual(list(report), sorted(report))
+        self.assertEqual(report["solver"], "test")
+        self.assertEqual(report["event"], "done")
+        self.assertEqual(report["nodes"], 5)
+        self.assertEqual(report["depths"], [[1, 3], [2, 1]])
+        self.assertEqual(report["prunes"], {"dead end": 3})
+        self.assertEqual(report["counters"], {"sleeps": 5})
+        self.assertEqual((report["max_time"], report["status"]), (7, "won"))
+        self.assertGreaterEqual(report["elapsed_seconds"], 0)
+        for field in ("nodes_per_second", "max_rss_kb"):
+            self.assertIn(field, report)
+
+    def test_progress(self):
+        stream = io.StringIO()
+        # Always due a report, but only looks at the clock every 4 nodes
+        telemetry = Telemetry("test", stream=stream, report_every=0, check_every=4)
+        for _ in range(10):
+            telemetry.node()
+        reports = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([(report["event"], report["nodes"]) for report in reports], [("progress", 4), ("progress", 8)])
+
+        # Nothing is written until it's been report_every seconds
+        stream = io.StringIO()
+        telemetry = Telemetry("test", stream=stream, report_every=3600, check_every=1)
+        for _ in range(10):
+            telemetry.node()
+        self.assertEqual(stream.getvalue(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()